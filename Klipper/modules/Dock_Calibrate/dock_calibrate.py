@@ -11,6 +11,8 @@ class DockCalibrate:
 		self.printer = config.get_printer()
 		self.name = config.get_name()
 		self.xy_resolution = config.getfloat('xy_resolution')
+		# CoreXY: x = (a + b) / 2, y = (a - b) / 2, scaled by the step distance
+		self.corexy_scale = self.xy_resolution / 2.
 		self.dock_extra_offset_x_unlock = config.getfloat('dock_extra_offset_x_unlock')
 		self.dock_extra_offset_y_unlock = config.getfloat('dock_extra_offset_y_unlock')
 		self.dock_extra_offset_x_lock = config.getfloat('dock_extra_offset_x_lock')
@@ -22,6 +24,10 @@ class DockCalibrate:
 		self.dock_calibrate_move_2_template = gcode_macro.load_template(config, 'dock_calibrate_move_2_gcode', '')
 		self.dock_test_template = gcode_macro.load_template(config, 'dock_test_gcode', '')
 		self.rod_install_msg_template = gcode_macro.load_template(config, 'rod_install_msg_gcode', '')
+		# XY steppers, looked up once at connect
+		self.stepper_x = None
+		self.stepper_y = None
+		self.printer.register_event_handler('klippy:connect', self.handle_connect)
 		
 		
 		self.gcode.register_command('CALC_DOCK_LOCATION', self.cmd_CALC_DOCK_LOCATION,
@@ -33,23 +39,41 @@ class DockCalibrate:
 	def get_status(self, eventtime):		
 		return {}
 				
-	def get_mcu_position(self):		
+	def handle_connect(self):
 		toolhead = self.printer.lookup_object('toolhead')
-		steppers = toolhead.kin.get_steppers()
-		for s in steppers:
+		for s in toolhead.get_kinematics().get_steppers():
 			if s.get_name() == "stepper_x":
-				mcu_pos_x = s.get_mcu_position()
-	  	
-			if s.get_name() == "stepper_y":
-				mcu_pos_y = s.get_mcu_position()
-			
-		return {'x':mcu_pos_x,
-				'y':mcu_pos_y}
+				self.stepper_x = s
+			elif s.get_name() == "stepper_y":
+				self.stepper_y = s
+		if self.stepper_x is None or self.stepper_y is None:
+			raise self.printer.config_error(
+				"%s requires stepper_x and stepper_y" % (self.name,))
+
+	def get_mcu_position(self):
+		return {'x':self.stepper_x.get_mcu_position(),
+				'y':self.stepper_y.get_mcu_position()}
+
+	def _steps_to_xy(self, start, end):
+		# Convert the A/B stepper travel between two positions into X/Y travel.
+		da = end['x'] - start['x']
+		db = end['y'] - start['y']
+		return ((da + db) * self.corexy_scale, (da - db) * self.corexy_scale)
+
+	def _save_variables(self, variables):
+		# SAVE_VARIABLE writes the whole variables file each time. Stage all but
+		# the last value in memory so a single SAVE_VARIABLE persists them all.
+		save_variables = self.printer.lookup_object('save_variables')
+		items = list(variables.items())
+		for name, value in items[:-1]:
+			save_variables.allVariables[name] = value
+		name, value = items[-1]
+		save_variables.cmd_SAVE_VARIABLE(self.gcode.create_gcode_command(
+			"SAVE_VARIABLE", "SAVE_VARIABLE", {"VARIABLE": name, 'VALUE': value}))
 
 	cmd_CALC_DOCK_LOCATION_help = "Automatically Calculate Dock Location for Selected Tool"
 	def cmd_CALC_DOCK_LOCATION(self, gcmd):
 		tool = gcmd.get("TOOL")
-		toolhead = self.printer.lookup_object('toolhead')
 
 		initial_res = self.get_mcu_position();
 		logging.info(initial_res)
@@ -62,27 +86,20 @@ class DockCalibrate:
 		move_2_res = self.get_mcu_position();
 		logging.info(move_2_res)
 		
-		dx2 = move_2_res['x'] - move_1_res['x']
-		dy2 = move_2_res['y'] - move_1_res['y']
+		unlock_dx, unlock_dy = self._steps_to_xy(move_1_res, move_2_res)
+		unlock_x = -unlock_dx + self.dock_extra_offset_x_unlock
+		unlock_y = -unlock_dy + self.dock_extra_offset_y_unlock
 
-		unlock_x = -(((dx2 + dy2)/2) * self.xy_resolution) + self.dock_extra_offset_x_unlock
-		unlock_y = -(((dx2 - dy2)/2) * self.xy_resolution) + self.dock_extra_offset_y_unlock
-
-		dx1 = move_2_res['x'] - initial_res['x']
-		dy1 = move_2_res['y'] - initial_res['y']
-		
-		
-		lock_x = -(((dx1 + dy1)/2) * self.xy_resolution) + self.dock_extra_offset_x_lock
-		lock_y = -(((dx1 - dy1)/2) * self.xy_resolution) + self.dock_extra_offset_y_lock
+		lock_dx, lock_dy = self._steps_to_xy(initial_res, move_2_res)
+		lock_x = -lock_dx + self.dock_extra_offset_x_lock
+		lock_y = -lock_dy + self.dock_extra_offset_y_lock
 		
 	
-		save_variables = self.printer.lookup_object('save_variables')
-
-		save_variables.cmd_SAVE_VARIABLE(self.gcode.create_gcode_command("SAVE_VARIABLE", "SAVE_VARIABLE", {"VARIABLE": 't'+tool+'_lock_x', 'VALUE': round(lock_x, 2) }))
-		save_variables.cmd_SAVE_VARIABLE(self.gcode.create_gcode_command("SAVE_VARIABLE", "SAVE_VARIABLE", {"VARIABLE": 't'+tool+'_lock_y', 'VALUE': round(lock_y, 2) }))
-
-		save_variables.cmd_SAVE_VARIABLE(self.gcode.create_gcode_command("SAVE_VARIABLE", "SAVE_VARIABLE", {"VARIABLE": 't'+tool+'_unlock_x', 'VALUE': round(unlock_x, 2) }))
-		save_variables.cmd_SAVE_VARIABLE(self.gcode.create_gcode_command("SAVE_VARIABLE", "SAVE_VARIABLE", {"VARIABLE": 't'+tool+'_unlock_y', 'VALUE': round(unlock_y, 2) }))
+		self._save_variables({
+			't'+tool+'_lock_x': round(lock_x, 2),
+			't'+tool+'_lock_y': round(lock_y, 2),
+			't'+tool+'_unlock_x': round(unlock_x, 2),
+			't'+tool+'_unlock_y': round(unlock_y, 2)})
 	
 			
 	cmd_DOCK_TEST_help = "Automatically Calculate Dock Location for Selected Tool"
@@ -13,10 +13,13 @@
 import math
 EPSILON = 0.001
 EPSILON_ANGLE = 0.001
+MAX_ANGLE = math.pi - EPSILON_ANGLE
 
 class ControlPoint:
+	__slots__ = ('vec', 'f', 'maxd', 'angle', 'len', 'lin_d', 'lin_d_to_r')
+
 	def __init__(self, x, y, z, d, f):
-		self.vec = [x,y,z]
+		self.vec = (x, y, z)
 		self.f = f
 		self.maxd = d
 		self.angle = 0.0
@@ -26,60 +29,40 @@ class ControlPoint:
 		self.lin_d_to_r = 0.0
 
 # Some basic vector math
-def _vecto(f: ControlPoint, t: ControlPoint)->list:
-	return [t.vec[i]-f.vec[i] for i in range(3)]
+# Vectors are plain 3-tuples; the helpers are unrolled by hand since they
+# are called per corner and per arc segment.
+def _vecto(f: ControlPoint, t: ControlPoint)->tuple:
+	fv = f.vec
+	tv = t.vec
+	return (tv[0]-fv[0], tv[1]-fv[1], tv[2]-fv[2])
 
-def _vadd(f: list, t: list) ->list:
-	return [f[i]+ t[i] for i in range(3)]
+def _vadd(f: tuple, t: tuple) ->tuple:
+	return (f[0]+t[0], f[1]+t[1], f[2]+t[2])
 
-def _vmul(f:list, n) ->list:
-	return [f[i] * n for i in range(3)]
+def _vmul(f:tuple, n) ->tuple:
+	return (f[0]*n, f[1]*n, f[2]*n)
 
-def _cross(vp: list, vn: list) -> list:
-	return [vp[1] * vn[2] - vp[2] * vn[1], vp[2] * vn[0] - vp[0] * vn[2],
-		   vp[0] * vn[1] - vp[1] * vn[0]]
+def _cross(vp: tuple, vn: tuple) -> tuple:
+	return (vp[1] * vn[2] - vp[2] * vn[1], vp[2] * vn[0] - vp[0] * vn[2],
+		   vp[0] * vn[1] - vp[1] * vn[0])
 
-def _vdist(v0: list, v1:list) -> float:
+def _vdist(v0: tuple, v1:tuple) -> float:
 	return math.hypot(v0[0]-v1[0], v0[1]-v1[1], v0[2]-v1[2])
 
-def _vnorm(vec: list) -> list:
-	invlen = 1.0/math.hypot(*vec)
-	return [x*invlen for x in vec]
+def _vnorm(vec: tuple) -> tuple:
+	invlen = 1.0/math.hypot(vec[0], vec[1], vec[2])
+	return (vec[0]*invlen, vec[1]*invlen, vec[2]*invlen)
 
-def _vangle(vec1: list, vec2: list) -> float:
+def _vangle(vec1: tuple, vec2: tuple) -> float:
 	crossx = vec1[1] * vec2[2] - vec1[2] * vec2[1]
 	crossy = vec1[2] * vec2[0] - vec1[0] * vec2[2]
 	crossz = vec1[0] * vec2[1] - vec1[1] * vec2[0]
-	cross = math.hypot(crossx, crossy, crossz)
+	cross_sq = crossx * crossx + crossy * crossy + crossz * crossz
 	dot = vec1[0] * vec2[0] + vec1[1] * vec2[1] + vec1[2] * vec2[2]
-	return math.atan2(cross, dot)
-
-def _vrot(vec: list, angle, axis: list) -> list:
-	# Axis needs to be normalized
-	# https://en.wikipedia.org/wiki/Rotation_matrix
-	s = math.sin(angle)
-	c = math.cos(angle)
-	t = 1 - c
-	return [
-		vec[0] * (t * axis[0] ** 2 + c) + vec[1] * (t * axis[0] * axis[1] - s * axis[2]) + vec[2] * (t * axis[0] * axis[2] + s * axis[1]),
-		vec[0] * (t * axis[0] * axis[1] + s * axis[2]) + vec[1] * (t * axis[1] ** 2 + c) + vec[2] * (t * axis[1] * axis[2] - s * axis[0]),
-		vec[0] * (t * axis[0] * axis[2] - s * axis[1]) + vec[1] * (t * axis[1] * axis[2] + s * axis[0]) + vec[2] * (t * axis[2] ** 2 + c)
-	]
-
-def _vrot_transform(angle: float, axis: list) -> list:
-	# Axis needs to be normalized
-	# https://en.wikipedia.org/wiki/Rotation_matrix
-	s = math.sin(angle)
-	c = math.cos(angle)
-	t = 1 - c
-	return [(t * axis[0] ** 2 + c), (t * axis[0] * axis[1] - s * axis[2]), (t * axis[0] * axis[2] + s * axis[1]),
-		(t * axis[0] * axis[1] + s * axis[2]), (t * axis[1] ** 2 + c), (t * axis[1] * axis[2] - s * axis[0]),
-		(t * axis[0] * axis[2] - s * axis[1]), (t * axis[1] * axis[2] + s * axis[0]), (t * axis[2] ** 2 + c)]
-
-def _vtransform(vec: list, transform: list) -> list:
-	return [vec[0] * transform[0] + vec[1]*transform[1] + vec[2]* transform[2],
-			vec[0] * transform[3] + vec[1] * transform[4] + vec[2] * transform[5],
-			vec[0] * transform[6] + vec[1] * transform[7] + vec[2] * transform[8]]
+	if cross_sq < 1e-20:
+		# Collinear, the common case for straight travel.
+		return 0.0 if dot >= 0 else math.pi
+	return math.atan2(math.sqrt(cross_sq), dot)
 
 class RoundedPath:
 	buffer: list[ControlPoint]
@@ -87,15 +70,14 @@ class RoundedPath:
 	def __init__(self, config):
 		self.printer = config.get_printer()
 		self.mm_per_arc_segment = config.getfloat('resolution', 1., above=0.0)
+		self.arc_segments_per_mm = 1. / self.mm_per_arc_segment
 
 		self.gcode_move = self.printer.load_object(config, 'gcode_move')
 		self.gcode = self.printer.lookup_object('gcode')
-		self.G0_params = {}
-		self.G0_cmd = self.gcode.create_gcode_command("G0", "G0", self.G0_params)
 		self.real_G0 = self.gcode_move.cmd_G1
 		self.gcode.register_command("ROUNDED_G0", self.cmd_ROUNDED_G0)
 		self.buffer = []
-		self.lastg0 = []
+		self.lastg0 = ()
 
 		if config.getboolean('replace_g0', False):
 			self.gcode.register_command("G0", None)
@@ -127,38 +109,44 @@ class RoundedPath:
 								  d = d))
 
 	def _lineto(self, pos):
-		self.buffer.append(pos)
-		if len(self.buffer) >= 3:
-			self._calculate_corner(self.buffer[-2], self.buffer[-3], self.buffer[-1])
-
-		if len(self.buffer) >= 2 and self.buffer[-1].maxd <= 0.0:
-			self._calculate_zero_corner(self.buffer[-1], self.buffer[-2])
+		buf = self.buffer
+		buf.append(pos)
+		size = len(buf)
+		if size >= 3:
+			self._calculate_corner(buf[-2], buf[-3], pos)
+
+		if size >= 2 and pos.maxd <= 0.0:
+			self._calculate_zero_corner(pos, buf[-2])
 			# zero max offset, flush everything.
-			self._flush_buffer(len(self.buffer) -2)
-			self._g0(self.buffer[-1])
-			self.buffer.clear()
-		elif len(self.buffer) >= 4 and self.buffer[-3].lin_d + self.buffer[-2].lin_d <= self.buffer[-2].len:
+			self._flush_buffer(size - 2)
+			self._g0(pos)
+			buf.clear()
+		elif size >= 4 and buf[-3].lin_d + buf[-2].lin_d <= buf[-2].len:
 			# max offsets don't overlap, flush everything, but the last segment.
-			self._flush_buffer(len(self.buffer) - 3)
+			self._flush_buffer(size - 3)
 
 	# Computes the max curve start offset along the edge based on max distance.
 	def _calculate_corner(self, c:ControlPoint, v1:ControlPoint, v2:ControlPoint):
 		vec1 = _vecto(c, v1)
 		vec2 = _vecto(c, v2)
-		c.len = math.hypot(*vec1)
-		c.angle = _vangle(vec1, vec2)
-		if abs(c.angle) < EPSILON_ANGLE or math.pi - abs(c.angle) < EPSILON_ANGLE:
-			# too close of an angle - do not bother
+		c.len = math.hypot(vec1[0], vec1[1], vec1[2])
+		angle = c.angle = _vangle(vec1, vec2)
+		abs_angle = abs(angle)
+		if abs_angle < EPSILON_ANGLE or abs_angle > MAX_ANGLE:
+			# too close of an angle - do not bother, no rounding at this corner
+			c.lin_d = 0.0
+			c.lin_d_to_r = 0.0
 			return
-		sina2 = math.sin(c.angle / 2)
-		tana2 = math.tan(c.angle/2)
+		half_angle = angle / 2
+		sina2 = math.sin(half_angle)
+		tana2 = math.tan(half_angle)
 		radius = c.maxd * sina2 / (1-sina2)
 		c.lin_d_to_r = tana2
 		c.lin_d = radius/tana2
 
 	def _calculate_zero_corner(self, c:ControlPoint, vp:ControlPoint):
 		vec1 = _vecto(c, vp)
-		c.len = math.hypot(*vec1)
+		c.len = math.hypot(vec1[0], vec1[1], vec1[2])
 		c.angle = 0
 
 	def _flush_buffer(self, num_segments):
@@ -174,82 +162,111 @@ class RoundedPath:
 
 		self._deconflict_lin_d(num_segments+1)
 
+		buf = self.buffer
+		arc = self._arc
 		for i in range(num_segments):
-			self._arc(self.buffer[i+1], self.buffer[i],self.buffer[i+2])
+			arc(buf[i+1], buf[i], buf[i+2])
 
-		self.buffer = self.buffer[num_segments:]
+		# Drop the emitted points in place, _lineto keeps a reference to the buffer.
+		del buf[:num_segments]
 		# Update where we finished
-		self.buffer[0].vec = self.lastg0
+		buf[0].vec = self.lastg0
 
 	def _deconflict_lin_d(self, num_segments):
-		order = [i+1 for i in range(num_segments)]
-		order = sorted(order, key=lambda a: self.buffer[a].len)
+		# Work on plain lists of the fields involved and store lin_d back once.
+		points = self.buffer[:num_segments+1]
+		lens = [p.len for p in points]
+		lin_ds = [p.lin_d for p in points]
+		d_to_rs = [p.lin_d_to_r for p in points]
 		# Process segments, shortest first
-		for i in order:
-			p0 = self.buffer[i-1]
-			p1 = self.buffer[i]
-			missingd = p1.lin_d + p0.lin_d - p1.len
+		for i in sorted(range(1, num_segments+1), key=lens.__getitem__):
+			d0 = lin_ds[i-1]
+			d1 = lin_ds[i]
+			seg_len = lens[i]
+			missingd = d1 + d0 - seg_len
 			if missingd <= 0:
 				continue
 
 			# first try to reduce the biggest radius
-			r0 = p0.lin_d * p0.lin_d_to_r
-			r1 = p1.lin_d * p1.lin_d_to_r
+			d_to_r0 = d_to_rs[i-1]
+			d_to_r1 = d_to_rs[i]
+			r0 = d0 * d_to_r0
+			r1 = d1 * d_to_r1
 			if r0 > r1:
-				missingr0 = missingd * p0.lin_d_to_r + EPSILON
+				missingr0 = missingd * d_to_r0 + EPSILON
 				r0 = max(r1, r0 - missingr0)
-				p0.lin_d = r0 / p0.lin_d_to_r
+				d0 = r0 / d_to_r0
 			elif r1 > r0:
-				missingr1 = missingd * p1.lin_d_to_r + EPSILON
+				missingr1 = missingd * d_to_r1 + EPSILON
 				r1 = max(r0, r1 - missingr1)
-				p1.lin_d = r1 / p1.lin_d_to_r
-			missingd = p1.lin_d + p0.lin_d - p1.len
-			if missingd <= 0:
-				continue
-			if p0.lin_d_to_r <= 0.0 or p1.lin_d_to_r <= 0.0:
-				# should never happen, just to be safe, floating points are tricky
-				p0.lin_d = 0
-				p1.lin_d = 0
-				continue
-			# that was not enough, reduce both proportionally
-			missingr_shared = missingd / (1/p0.lin_d_to_r + 1/p1.lin_d_to_r)
-			p0.lin_d = max(0.0, p0.lin_d - missingr_shared / p0.lin_d_to_r)
-			p1.lin_d = max(0.0, p1.lin_d - missingr_shared / p1.lin_d_to_r)
+				d1 = r1 / d_to_r1
+			missingd = d1 + d0 - seg_len
+			if missingd > 0:
+				if d_to_r0 <= 0.0 or d_to_r1 <= 0.0:
+					# should never happen, just to be safe, floating points are tricky
+					d0 = 0
+					d1 = 0
+				else:
+					# that was not enough, reduce both proportionally
+					missingr_shared = missingd / (1/d_to_r0 + 1/d_to_r1)
+					d0 = max(0.0, d0 - missingr_shared / d_to_r0)
+					d1 = max(0.0, d1 - missingr_shared / d_to_r1)
+			lin_ds[i-1] = d0
+			lin_ds[i] = d1
+
+		for p, lin_d in zip(points, lin_ds):
+			p.lin_d = lin_d
 
 	def _arc(self, c:ControlPoint, p:ControlPoint, n:ControlPoint):
-		radius = c.lin_d * c.lin_d_to_r
-		num_segments = math.floor(radius * c.angle / self.mm_per_arc_segment)
+		lin_d = c.lin_d
+		radius = lin_d * c.lin_d_to_r
+		# Angle and radius are never negative, so int() truncation is floor().
+		num_segments = int(radius * c.angle * self.arc_segments_per_mm)
 		if num_segments < 1:
 			self._g0(c)
 			return
 		vp = _vnorm(_vecto(c, p))
-		vn = _vnorm(_vecto(c, n))
-		rotaxis = _vnorm(_cross(vp, vn))
-		start = _vadd(c.vec, _vmul(vp, c.lin_d))
-		spoke = _vmul(_vrot(vp, math.pi/2, rotaxis), -radius)
+		# Only the direction of vn matters for the axis, so it is not normalized.
+		rotaxis = _vnorm(_cross(vp, _vecto(c, n)))
+		start = _vadd(c.vec, _vmul(vp, lin_d))
+		# vp is perpendicular to the axis, so rotating it by 90 degrees is axis x vp.
+		spoke = _vmul(_cross(rotaxis, vp), -radius)
 		center = _vadd(start, _vmul(spoke, -1.0))
 
 		# We are rotating counter the segment rotation.
-		rot_transform = _vrot_transform(-c.angle / num_segments, rotaxis)
-		rotspoke = spoke
-		self._g0p(c, _vadd(center, rotspoke))
-		for step in range(0, num_segments):
-			rotspoke = _vtransform(rotspoke, rot_transform)
-			self._g0p(c, _vadd(center, rotspoke))
+		# The spoke is perpendicular to the axis, so Rodrigues' formula reduces to
+		# spoke * cos(a) + (axis x spoke) * sin(a), evaluated directly per point.
+		perp = _cross(rotaxis, spoke)
+		step_angle = -c.angle / num_segments
+		sin = math.sin
+		cos = math.cos
+		g0p = self._g0p
+		cx, cy, cz = center
+		sx, sy, sz = spoke
+		px, py, pz = perp
+		for step in range(0, num_segments + 1):
+			a = step_angle * step
+			ca = cos(a)
+			sa = sin(a)
+			# Build only the emitted point, no intermediate vectors.
+			g0p(c, (cx + sx * ca + px * sa, cy + sy * ca + py * sa, cz + sz * ca + pz * sa))
 
 	def _g0(self, p: ControlPoint):
 		self._g0p(p, p.vec)
 
-	def _g0p(self, p: ControlPoint, vec: list):
-		self.G0_params["X"]=vec[0]
-		self.G0_params["Y"]=vec[1]
-		self.G0_params["Z"]=vec[2]
+	def _g0p(self, p: ControlPoint, vec: tuple):
+		# Same as an absolute G0 through gcode_move.cmd_G1, without building
+		# and parsing a gcode command for every arc point.
+		gcode_move = self.gcode_move
+		base = gcode_move.base_position
+		pos = gcode_move.last_position
+		pos[0] = vec[0] + base[0]
+		pos[1] = vec[1] + base[1]
+		pos[2] = vec[2] + base[2]
 		if p.f > 0.0:
-			self.G0_params['F'] = p.f
-		else:
-			self.G0_params.pop('F', None)
+			gcode_move.speed = p.f * gcode_move.speed_factor
 		self.lastg0 = vec
-		self.real_G0(self.G0_cmd)
+		gcode_move.move_with_transform(pos, gcode_move.speed)
 
 def load_config(config):
 	return RoundedPath(config)
\ No newline at end of file
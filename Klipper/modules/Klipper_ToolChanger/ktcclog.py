@@ -16,8 +16,8 @@
 # ToolLock: Toollock is engaged.
 # ToolUnLock: Toollock is disengaged.
 
-import logging, logging.handlers, threading, queue, time
-import math, os.path, copy
+import logging, logging.handlers, threading, collections, time
+import os.path
 
 # Forward all messages through a queue (polled by background thread)
 class KtccQueueHandler(logging.Handler):
@@ -27,7 +27,8 @@ class KtccQueueHandler(logging.Handler):
 
     def emit(self, record):
         try:
-            self.format(record)
+            # Only merge the args here, the listener's formatter does the rest.
+            record.message = record.getMessage()
             record.msg = record.message
             record.args = None
             record.exc_info = None
@@ -35,21 +36,94 @@ class KtccQueueHandler(logging.Handler):
         except Exception:
             self.handleError(record)
 
-# Poll log queue on background thread and log each message to logfile
+# Buffer of log records handed to the background thread in batches.
+# If the writer falls behind, the oldest records are dropped.
+# deque.append() and popleft() are atomic, so producers only take the lock
+# to wake up the background thread when it is waiting for records.
+class KtccLogBuffer:
+    MAX_RECORDS = 10000
+
+    def __init__(self):
+        self.records = collections.deque(maxlen=self.MAX_RECORDS)
+        self.cond = threading.Condition()
+        self.waiting = False
+
+    def put_nowait(self, record):
+        self.records.append(record)
+        if self.waiting:
+            with self.cond:
+                self.cond.notify()
+
+    # Only to be called from the single consumer thread.
+    def get_batch(self, timeout=None):
+        records = self.records
+        if not records:
+            with self.cond:
+                self.waiting = True
+                if not records:
+                    self.cond.wait(timeout)
+                self.waiting = False
+        return [records.popleft() for _ in range(len(records))]
+
+# Poll log buffer on background thread and log each message to logfile.
+# Writes are buffered and flushed at most every FLUSH_INTERVAL seconds.
 class KtccQueueListener(logging.handlers.TimedRotatingFileHandler):
+    BUFFER_SIZE = 64 * 1024
+    FLUSH_INTERVAL = 1.
+
     def __init__(self, filename):
         logging.handlers.TimedRotatingFileHandler.__init__(
             self, filename, when='midnight', backupCount=5)
-        self.bg_queue = queue.Queue()
+        self.bg_queue = KtccLogBuffer()
         self.bg_thread = threading.Thread(target=self._bg_thread)
         self.bg_thread.start()
 
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=self.BUFFER_SIZE,
+                    encoding=self.encoding)
+
+    def emit(self, record):
+        # Same as TimedRotatingFileHandler.emit() without the flush per record
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+    # Queue a plain message without going through the logging framework.
+    # The LogRecord is only created on the background thread.
+    def put_message(self, message):
+        self.bg_queue.put_nowait((time.time(), message))
+
+    def _make_record(self, created, message):
+        return logging.makeLogRecord({
+            'msg': message, 'created': created,
+            'levelno': logging.INFO, 'levelname': 'INFO'})
+
     def _bg_thread(self):
+        last_flush = time.monotonic()
+        unflushed = False
         while True:
-            record = self.bg_queue.get(True)
-            if record is None:
-                break
-            self.handle(record)
+            timeout = self.FLUSH_INTERVAL if unflushed else None
+            flush_now = False
+            for record in self.bg_queue.get_batch(timeout):
+                if record is None:
+                    self.flush()
+                    return
+                if type(record) is tuple:
+                    record = self._make_record(*record)
+                self.handle(record)
+                unflushed = True
+                if record.levelno >= logging.WARNING:
+                    flush_now = True
+            now = time.monotonic()
+            if unflushed and (flush_now or now - last_flush >= self.FLUSH_INTERVAL):
+                self.flush()
+                last_flush = now
+                unflushed = False
 
     def stop(self):
         self.bg_queue.put_nowait(None)
@@ -57,16 +131,75 @@ class KtccQueueListener(logging.handlers.TimedRotatingFileHandler):
 
 # Class to improve formatting of multi-line KTCC messages
 class KtccMultiLineFormatter(logging.Formatter):
+    INDENT = '\n' + ' ' * 9
+
     def format(self, record):
-        indent = ' ' * 9
         lines = super(KtccMultiLineFormatter, self).format(record)
-        return lines.replace('\n', '\n' + indent)
+        if '\n' not in lines:
+            return lines
+        return lines.replace('\n', self.INDENT)
+
+# Statistics of one tool. The tracked_* fields hold the monotonic start time
+# of a running measurement, or 0, and are not persisted.
+class KtccToolStatistics:
+    PERSISTED_FIELDS = (
+        'toolmounts_completed', 'toolunmounts_completed', 'toolmounts_started', 'toolunmounts_started',
+        'time_selected', 'time_heater_active', 'time_heater_standby',
+        'total_time_spent_unmounting', 'total_time_spent_mounting')
+    TRACKED_FIELDS = (
+        'tracked_start_time_selected', 'tracked_start_time_active', 'tracked_start_time_standby',
+        'tracked_unmount_start_time', 'tracked_mount_start_time')
+    __slots__ = PERSISTED_FIELDS + TRACKED_FIELDS
+    # Fields holding durations in seconds, kept rounded to milliseconds
+    TIME_FIELDS = frozenset([
+        'time_selected', 'time_heater_active', 'time_heater_standby',
+        'total_time_spent_unmounting', 'total_time_spent_mounting'])
+
+    def __init__(self, values=None):
+        for field in self.__slots__:
+            setattr(self, field, 0)
+        if values:
+            self.update_from_dict(values)
+
+    def update_from_dict(self, values):
+        for field in self.PERSISTED_FIELDS:
+            if field in values:
+                setattr(self, field, values[field] or 0)
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.PERSISTED_FIELDS}
+
+    def copy(self):
+        stats = KtccToolStatistics()
+        for field in self.__slots__:
+            setattr(stats, field, getattr(self, field))
+        return stats
 
 class KtccLog:
     TOOL_UNKNOWN = -2
     TOOL_UNLOCKED = -1
-    EMPTY_TOOL_STATS = {'toolmounts_completed': 0, 'toolunmounts_completed': 0, 'toolmounts_started': 0, 'toolunmounts_started': 0, 'time_selected': 0, 'time_heater_active': 0, 'time_heater_standby': 0, 'tracked_start_time_selected':0, 'tracked_start_time_active':0, 'tracked_start_time_standby':0, 'total_time_spent_unmounting':0, 'total_time_spent_mounting':0}
     KTCC_TOOL_STATISTICS_PREFIX = "ktcc_statistics_tool"
+    # Bits of _dirty_mask, telling what statistics need to be persisted
+    DIRTY_SWAP_STATISTICS = 1
+    DIRTY_TOOL_STATISTICS = 2
+    # Names of the log levels, indexed by level + 1 and by visual level
+    LOG_LEVEL_NAMES = ("OFF", "ESSENTIAL MESSAGES", "INFO", "DEBUG", "TRACE")
+    VISUAL_LOG_LEVEL_NAMES = ("OFF", "LONG", "SHORT")
+    TOTAL_STATISTICS_COUNTERS = frozenset(['total_toolmounts', 'total_toolunmounts', 'total_toollocks', 'total_toolunlocks'])
+
+    __slots__ = (
+        'config', 'gcode', 'printer', 'reactor', 'toolhead', 'prev_G28', 'variables', 'timer_save',
+        # Logging
+        'log_level', 'logfile_level', 'log_statistics', 'log_visual', 'queue_listener', 'ktcc_logger',
+        '_info_enabled', '_debug_enabled', '_trace_enabled',
+        # Saving
+        'save_delay', 'save_active', '_dirty_mask', '_dirty_tools',
+        # Statistics
+        'total_time_spent_mounting', 'total_time_spent_unmounting', 'total_toollocks', 'total_toolunlocks',
+        'total_toolmounts', 'total_toolunmounts', 'tracked_mount_start_time', 'pause_start_time',
+        'print_time_spent_mounting', 'print_time_spent_unmounting', 'print_toollocks', 'print_toolunlocks',
+        'print_toolmounts', 'print_toolunmounts', 'tool_statistics', 'print_tool_statistics',
+        '_tool_objs', '_sorted_tool_ids', '_swap_statistics_epoch', '_swap_statistics_text')
 
     def __init__(self, config):
         self.config = config
@@ -87,9 +220,15 @@ class KtccLog:
         # Logging
         self.queue_listener = None
         self.ktcc_logger = None
+        self._update_log_gates()
 
         # Save to file
-        self.changes_to_save = False
+        self._dirty_mask = 0
+        # Bumped on every change to the swap statistics, to know when the
+        # cached (epoch, text) in _swap_statistics_text is stale.
+        self._swap_statistics_epoch = 0
+        self._swap_statistics_text = None
+        self._dirty_tools = set()
         self.save_delay = 10
         self.save_active = True
 
@@ -127,14 +266,14 @@ class KtccLog:
 
     def _save_changes_timer_event(self, eventtime):
         try:
-            if self.save_active and self.changes_to_save:
-                self.changes_to_save = False
+            if self.save_active and self._dirty_mask:
+                dirty_mask, self._dirty_mask = self._dirty_mask, 0
+                dirty_tools, self._dirty_tools = self._dirty_tools, set()
                 self.trace("Saving state in logs.")
 
-                self._persist_swap_statistics()
-                self._persist_tool_statistics()
+                self._persist_statistics(dirty_mask & self.DIRTY_SWAP_STATISTICS, dirty_tools)
         except Exception as e:
-            self.debug("_save_changes_timer_event:Exception: %s" % (str(e)))
+            self.debug("_save_changes_timer_event:Exception: %s", e)
             logging.exception("_save_changes_timer_event:Exception: %s" % (str(e)))
         nextwake = eventtime + self.save_delay
         return nextwake
@@ -151,13 +290,14 @@ class KtccLog:
                 ktcc_log = '/tmp/ktcc.log'
             else:
                 ktcc_log = dirname + '/ktcc.log'
-            self.debug("ktcc_log=%s" % ktcc_log)
+            self.debug("ktcc_log=%s", ktcc_log)
             self.queue_listener = KtccQueueListener(ktcc_log)
             self.queue_listener.setFormatter(KtccMultiLineFormatter('%(asctime)s %(message)s', datefmt='%I:%M:%S'))
             queue_handler = KtccQueueHandler(self.queue_listener.bg_queue)
             self.ktcc_logger = logging.getLogger('ktcc')
             self.ktcc_logger.setLevel(logging.INFO)
             self.ktcc_logger.addHandler(queue_handler)
+            self._update_log_gates()
 
         # Load saved values
         self._load_persisted_state()
@@ -193,19 +333,16 @@ class KtccLog:
             self._reset_statistics()
 
         self.tool_statistics = {}
+        self._tool_objs = {}
         for tool in self.printer.lookup_objects('tool'):
             try:
-                toolname=str(tool[0])
-                toolname=toolname[toolname.rindex(' ')+1:]
-                self.tool_statistics[toolname] = self.variables.get("%s%s" % (self.KTCC_TOOL_STATISTICS_PREFIX, toolname), self.EMPTY_TOOL_STATS.copy())
-                self.tool_statistics[toolname]["tracked_start_time_selected"] = 0
-                self.tool_statistics[toolname]["tracked_start_time_active"] = 0
-                self.tool_statistics[toolname]["tracked_start_time_standby"] = 0
-                self.tool_statistics[toolname]["tracked_unmount_start_time"] = 0
-                self.tool_statistics[toolname]["tracked_mount_start_time"] = 0
+                toolname = tool[0].rsplit(' ', 1)[-1]
+                self._tool_objs[toolname] = tool[1]
+                self.tool_statistics[toolname] = KtccToolStatistics(self.variables.get("%s%s" % (self.KTCC_TOOL_STATISTICS_PREFIX, toolname)))
 
             except Exception as err:
-                self.debug("Unexpected error in toolstast: %s" % err)
+                self.debug("Unexpected error in toolstast: %s", err)
+        self._sorted_tool_ids = sorted(self.tool_statistics, key=int)
 
     def _reset_print_statistics(self):
         # Init persihabele statistics
@@ -215,7 +352,7 @@ class KtccLog:
         self.print_toolunlocks = self.total_toolunlocks
         self.print_toolmounts = self.total_toolmounts
         self.print_toolunmounts = self.total_toolunmounts
-        self.print_tool_statistics = copy.deepcopy(self.tool_statistics)
+        self.print_tool_statistics = {tool: tool_stats.copy() for tool, tool_stats in self.tool_statistics.items()}
 
 ####################################
 # LOGGING FUNCTIONS                #
@@ -228,29 +365,62 @@ class KtccLog:
     #        self.ktcc_logger.info(message)
     #    self.gcode.respond_info(message)
 
-    def info(self, message):
+    def info(self, message, *args):
+        if not self._info_enabled:
+            return
+        if args:
+            message = message % args
         if self.ktcc_logger and self.logfile_level > 0:
             self.ktcc_logger.info(message)
         if self.log_level > 0:
             self.gcode.respond_info(message)
 
-    def always(self, message):
+    def always(self, message, *args):
+            if args:
+                message = message % args
             if self.ktcc_logger and self.logfile_level > 0:
                 self.ktcc_logger.info(message)
             if self.log_level > 0:
                 self.gcode.respond_info(message)
 
-    def debug(self, message):
+    # Precompute whether messages of each level go anywhere so that
+    # disabled messages return before any formatting is done.
+    def _update_log_gates(self):
+        has_logfile = self.ktcc_logger is not None
+        self._info_enabled = self.log_level > 0 or (has_logfile and self.logfile_level > 0)
+        self._debug_enabled = self.log_level > 1 or (has_logfile and self.logfile_level > 1)
+        self._trace_enabled = self.log_level > 2 or (has_logfile and self.logfile_level > 2)
+
+    # Lets callers skip building log arguments that are costly on their own.
+    # info_enabled also covers always(), which goes to the same outputs.
+    @property
+    def info_enabled(self):
+        return self._info_enabled
+
+    @property
+    def trace_enabled(self):
+        return self._trace_enabled
+
+    # The log functions accept optional %-style args, only formatted when the message is output.
+    def debug(self, message, *args):
+        if not self._debug_enabled:
+            return
+        if args:
+            message = message % args
         message = "- DEBUG: %s" % message
         if self.ktcc_logger and self.logfile_level > 1:
             self.ktcc_logger.info(message)
         if self.log_level > 1:
             self.gcode.respond_info(message)
 
-    def trace(self, message):
+    def trace(self, message, *args):
+        if not self._trace_enabled:
+            return
+        if args:
+            message = message % args
         message = "- - TRACE: %s" % message
-        if self.ktcc_logger and self.logfile_level > 2:
-            self.ktcc_logger.info(message)
+        if self.queue_listener is not None and self.logfile_level > 2:
+            self.queue_listener.put_message(message)
         if self.log_level > 2:
             self.gcode.respond_info(message)
 
@@ -260,18 +430,10 @@ class KtccLog:
             self.always(self._state_to_human_string())
 
     def _log_level_to_human_string(self, level):
-        log = "OFF"
-        if level > 2: log = "TRACE"
-        elif level > 1: log = "DEBUG"
-        elif level > 0: log = "INFO"
-        elif level > -1: log = "ESSENTIAL MESSAGES"
-        return log
+        return self.LOG_LEVEL_NAMES[max(0, min(level + 1, len(self.LOG_LEVEL_NAMES) - 1))]
 
     def _visual_log_level_to_human_string(self, level):
-        log = "OFF"
-        if level > 1: log = "SHORT"
-        elif level > 0: log = "LONG"
-        return log
+        return self.VISUAL_LOG_LEVEL_NAMES[max(0, min(level, len(self.VISUAL_LOG_LEVEL_NAMES) - 1))]
 
 
 
@@ -294,131 +456,127 @@ class KtccLog:
         self.tool_statistics = {}
         for tool in self.printer.lookup_objects('tool'):
             try:
-                toolname=str(tool[0])
-                toolname=toolname[toolname.rindex(' ')+1:]
-                self.tool_statistics[toolname] = self.EMPTY_TOOL_STATS.copy()
-                self.tool_statistics[toolname]["tracked_start_time_selected"] = 0
-                self.tool_statistics[toolname]["tracked_start_time_active"] = 0
-                self.tool_statistics[toolname]["tracked_start_time_standby"] = 0
-                self.tool_statistics[toolname]["tracked_unmount_start_time"] = 0
-                self.tool_statistics[toolname]["tracked_mount_start_time"] = 0
+                toolname = tool[0].rsplit(' ', 1)[-1]
+                self.tool_statistics[toolname] = KtccToolStatistics()
 
             except Exception as err:
-                self.debug("Unexpected error in toolstast: %s" % err)
+                self.debug("Unexpected error in toolstast: %s", err)
+        self._sorted_tool_ids = sorted(self.tool_statistics, key=int)
 
 
     def track_mount_start(self, tool_id):
-        self.trace("track_mount_start: Running for Tool: %s." % (tool_id))
-        self._set_tool_statistics(tool_id, 'tracked_mount_start_time', time.time())
+        self.trace("track_mount_start: Running for Tool: %s.", tool_id)
+        self._set_tool_statistics(tool_id, 'tracked_mount_start_time', time.monotonic())
         
 
     def track_mount_end(self, tool_id):
-        self.trace("track_mount_end: Running for Tool: %s." % (tool_id))
-        start_time = self.tool_statistics[str(tool_id)]['tracked_mount_start_time']
+        self.trace("track_mount_end: Running for Tool: %s.", tool_id)
+        start_time = self.tool_statistics[str(tool_id)].tracked_mount_start_time
         if start_time is not None and start_time != 0:
             # self.trace("track_mount_end: start_time is not None for Tool: %s." % (tool_id))
-            time_spent = time.time() - start_time
+            time_spent = time.monotonic() - start_time
             self.increase_tool_statistics(tool_id, 'total_time_spent_mounting', time_spent)
             self.total_time_spent_mounting += time_spent
             self._set_tool_statistics(tool_id, 'tracked_mount_start_time', 0)
-            self.changes_to_save = True
+            self._mark_swap_statistics_dirty()
 
     def track_unmount_start(self, tool_id):
-        self.trace("track_unmount_start: Running for Tool: %s." % (tool_id))
-        self._set_tool_statistics(tool_id, 'tracked_unmount_start_time', time.time())
+        self.trace("track_unmount_start: Running for Tool: %s.", tool_id)
+        self._set_tool_statistics(tool_id, 'tracked_unmount_start_time', time.monotonic())
         self.increase_tool_statistics(tool_id, 'toolunmounts_started')
 
     def track_unmount_end(self, tool_id):
-        self.trace("track_unmount_end: Running for Tool: %s." % (tool_id))
-        start_time = self.tool_statistics[str(tool_id)]['tracked_unmount_start_time']
+        self.trace("track_unmount_end: Running for Tool: %s.", tool_id)
+        start_time = self.tool_statistics[str(tool_id)].tracked_unmount_start_time
         if start_time is not None and start_time != 0:
             # self.trace("track_unmount_end: start_time is not None for Tool: %s." % (tool_id))
-            time_spent = time.time() - start_time
+            time_spent = time.monotonic() - start_time
             self.increase_tool_statistics(tool_id, 'total_time_spent_unmounting', time_spent)
             self.total_time_spent_unmounting += time_spent
             self._set_tool_statistics(tool_id, 'tracked_unmount_start_time', 0)
             self.increase_tool_statistics(tool_id, 'toolunmounts_completed')
             self.increase_statistics('total_toolunmounts')
-            self.changes_to_save = True
+            self._mark_swap_statistics_dirty()
 
 
     def increase_statistics(self, key, count=1):
         try:
-            self.trace("increase_statistics: Running. Provided to record tool stats while key: %s and count: %s" % (str(key), str(count)))
-            if key == 'total_toolmounts':
-                self.total_toolmounts += int(count)
-            elif key == 'total_toolunmounts':
-                self.total_toolunmounts += int(count)
-            elif key == 'total_toollocks':
-                self.total_toollocks += int(count)
-            elif key == 'total_toolunlocks':
-                self.total_toolunlocks += int(count)
-            self.changes_to_save = True
+            self.trace("increase_statistics: Running. Provided to record tool stats while key: %s and count: %s", key, count)
+            if key in self.TOTAL_STATISTICS_COUNTERS:
+                setattr(self, key, getattr(self, key) + int(count))
+            self._mark_swap_statistics_dirty()
         except Exception as e:
-            self.debug("Exception whilst tracking tool stats: %s" % str(e))
-            self.debug("increase_statistics: Error while increasing stats while key: %s and count: %s" % (str(key), str(count)))
+            self.debug("Exception whilst tracking tool stats: %s", e)
+            self.debug("increase_statistics: Error while increasing stats while key: %s and count: %s", key, count)
 
     def track_selected_tool_start(self, tool_id):
-        self.trace("track_selected_tool_start: Running for Tool: %s." % (tool_id))
-        self._set_tool_statistics(tool_id, 'tracked_start_time_selected', time.time())
+        self.trace("track_selected_tool_start: Running for Tool: %s.", tool_id)
+        self._set_tool_statistics(tool_id, 'tracked_start_time_selected', time.monotonic())
         self.increase_statistics('total_toolmounts')
         self.increase_tool_statistics(tool_id, 'toolmounts_completed')
 
     def track_selected_tool_end(self, tool_id):
-        self.trace("track_selected_tool_end: Running for Tool: %s." % (tool_id))
+        self.trace("track_selected_tool_end: Running for Tool: %s.", tool_id)
         self._set_tool_statistics_time_diff(tool_id, 'time_selected', 'tracked_start_time_selected')
-        self.changes_to_save = True
 
     def track_active_heater_start(self, tool_id):
-        self.trace("track_active_heater_start: Running for Tool: %s." % (tool_id))
-        self._set_tool_statistics(tool_id, 'tracked_start_time_active', time.time())
+        self.trace("track_active_heater_start: Running for Tool: %s.", tool_id)
+        self._set_tool_statistics(tool_id, 'tracked_start_time_active', time.monotonic())
 
     def track_active_heater_end(self, tool_id):
-        self.trace("track_active_heater_end: Running for Tool: %s." % (tool_id))
+        self.trace("track_active_heater_end: Running for Tool: %s.", tool_id)
         self._set_tool_statistics_time_diff(tool_id, 'time_heater_active', 'tracked_start_time_active')
-        self.changes_to_save = True
 
     def track_standby_heater_start(self, tool_id):
-        self.trace("track_standby_heater_start: Running for Tool: %s." % (tool_id))
-        self._set_tool_statistics(tool_id, 'tracked_start_time_standby', time.time())
+        self.trace("track_standby_heater_start: Running for Tool: %s.", tool_id)
+        self._set_tool_statistics(tool_id, 'tracked_start_time_standby', time.monotonic())
 
     def track_standby_heater_end(self, tool_id):
-        self.trace("track_standby_heater_end: Running for Tool: %s." % (tool_id))
+        self.trace("track_standby_heater_end: Running for Tool: %s.", tool_id)
         self._set_tool_statistics_time_diff(tool_id, 'time_heater_standby', 'tracked_start_time_standby')
-        self.changes_to_save = True
 
     def _seconds_to_human_string(self, seconds):
         result = ""
-        hours = int(math.floor(seconds / 3600.))
+        minutes, seconds = divmod(int(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
         if hours >= 1:
             result += "%d hours " % hours
-        minutes = int(math.floor(seconds / 60.) % 60)
         if hours >= 1 or minutes >= 1:
             result += "%d minutes " % minutes
-        result += "%d seconds" % int((math.floor(seconds) % 60))
+        result += "%d seconds" % seconds
         return result
 
+    # Templates for the statistics dumps, filled with a single % each
+    SWAP_STATISTICS_FORMAT = ("%s:"
+                              "\n%s spent mounting tools"
+                              "\n%s spent unmounting tools"
+                              "\n%d tool locks completed"
+                              "\n%d tool unlocks completed"
+                              "\n%d tool mounts completed"
+                              "\n%d tool unmounts completed")
+    TOOL_MOUNTS_FORMAT = "Completed %d out of %d mounts in %s. Average of %s per toolmount.\n"
+    TOOL_UNMOUNTS_FORMAT = "Completed %d out of %d unmounts in %s. Average of %s per toolunmount.\n"
+
     def _swap_statistics_to_human_string(self):
-        msg = "KTCC Statistics:"
-        # msg += "\n%d swaps completed" % self.total_mounts
-        msg += "\n%s spent mounting tools" % self._seconds_to_human_string(self.total_time_spent_mounting)
-        msg += "\n%s spent unmounting tools" % self._seconds_to_human_string(self.total_time_spent_unmounting)
-        msg += "\n%d tool locks completed" % self.total_toollocks
-        msg += "\n%d tool unlocks completed" % self.total_toolunlocks
-        msg += "\n%d tool mounts completed" % self.total_toolmounts
-        msg += "\n%d tool unmounts completed" % self.total_toolunmounts
-        return msg
+        cached = self._swap_statistics_text
+        if cached is not None and cached[0] == self._swap_statistics_epoch:
+            return cached[1]
+        text = self.SWAP_STATISTICS_FORMAT % (
+            "KTCC Statistics",
+            self._seconds_to_human_string(self.total_time_spent_mounting),
+            self._seconds_to_human_string(self.total_time_spent_unmounting),
+            self.total_toollocks, self.total_toolunlocks,
+            self.total_toolmounts, self.total_toolunmounts)
+        self._swap_statistics_text = (self._swap_statistics_epoch, text)
+        return text
 
     def _swap_print_statistics_to_human_string(self):
-        msg = "KTCC Statistics for this print:"
-        # msg += "\n%d swaps completed" % self.total_mounts
-        msg += "\n%s spent mounting tools" % self._seconds_to_human_string(self.total_time_spent_mounting-self.print_time_spent_mounting)
-        msg += "\n%s spent unmounting tools" % self._seconds_to_human_string(self.total_time_spent_unmounting-self.print_time_spent_unmounting)
-        msg += "\n%d tool locks completed" % (self.total_toollocks-self.print_toollocks)
-        msg += "\n%d tool unlocks completed" % (self.total_toolunlocks-self.print_toolunlocks)
-        msg += "\n%d tool mounts completed" % (self.total_toolmounts-self.print_toolmounts)
-        msg += "\n%d tool unmounts completed" % (self.total_toolunmounts-self.print_toolunmounts)
-        return msg
+        return self.SWAP_STATISTICS_FORMAT % (
+            "KTCC Statistics for this print",
+            self._seconds_to_human_string(self.total_time_spent_mounting-self.print_time_spent_mounting),
+            self._seconds_to_human_string(self.total_time_spent_unmounting-self.print_time_spent_unmounting),
+            self.total_toollocks-self.print_toollocks, self.total_toolunlocks-self.print_toolunlocks,
+            self.total_toolmounts-self.print_toolmounts, self.total_toolunmounts-self.print_toolunmounts)
 
     def _division(self, dividend, divisor):
         try:
@@ -427,55 +585,46 @@ class KtccLog:
             return 0
 
     def _dump_statistics(self, report=False):
-        if self.log_statistics or report:
-            msg = "ToolChanger Statistics:\n"
-            msg += self._swap_statistics_to_human_string()
-            msg += "\n------------\n"
-
-            msg += "Tool Statistics:\n"
-
-            # First convert to int so we get right order.
-            res = {int(k):v for k,v in self.tool_statistics.items()}
-            for tid in res:
-                tool_id= str(tid)
-                msg += "Tool#%s:\n" % (tool_id)
-                msg += "Completed %d out of %d mounts in %s. Average of %s per toolmount.\n" % (self.tool_statistics[tool_id]['toolmounts_completed'], self.tool_statistics[tool_id]['toolmounts_started'], self._seconds_to_human_string(self.tool_statistics[tool_id]['total_time_spent_mounting']), self._seconds_to_human_string(self._division(self.tool_statistics[tool_id]['total_time_spent_mounting'], self.tool_statistics[tool_id]['toolmounts_completed'])))
-                msg += "Completed %d out of %d unmounts in %s. Average of %s per toolunmount.\n" % (self.tool_statistics[tool_id]['toolunmounts_completed'], self.tool_statistics[tool_id]['toolunmounts_started'], self._seconds_to_human_string(self.tool_statistics[tool_id]['total_time_spent_unmounting']), self._seconds_to_human_string(self._division(self.tool_statistics[tool_id]['total_time_spent_unmounting'], self.tool_statistics[tool_id]['toolunmounts_completed'])))
-                msg += "%s spent selected." % self._seconds_to_human_string(self.tool_statistics[tool_id]['time_selected'])
-                tool = self.printer.lookup_object("tool " + str(tool_id))
+        # The statistics dumps are only built when they are going to be output.
+        if (self.log_statistics or report) and self._info_enabled:
+            parts = ["ToolChanger Statistics:\n",
+                     self._swap_statistics_to_human_string(),
+                     "\n------------\nTool Statistics:\n"]
+
+            for tool_id in self._sorted_tool_ids:
+                ts = self.tool_statistics[tool_id]
+                parts.append("Tool#%s:\n" % (tool_id))
+                parts.append(self.TOOL_MOUNTS_FORMAT % (ts.toolmounts_completed, ts.toolmounts_started, self._seconds_to_human_string(ts.total_time_spent_mounting), self._seconds_to_human_string(self._division(ts.total_time_spent_mounting, ts.toolmounts_completed))))
+                parts.append(self.TOOL_UNMOUNTS_FORMAT % (ts.toolunmounts_completed, ts.toolunmounts_started, self._seconds_to_human_string(ts.total_time_spent_unmounting), self._seconds_to_human_string(self._division(ts.total_time_spent_unmounting, ts.toolunmounts_completed))))
+                parts.append("%s spent selected." % self._seconds_to_human_string(ts.time_selected))
+                tool = self._tool_objs[tool_id]
                 if tool.is_virtual != True or tool.name==tool.physical_parent_id:
                     if tool.extruder is not None:
-                        msg += " %s with active heater and %s with standby heater." % (self._seconds_to_human_string(self.tool_statistics[tool_id]['time_heater_active']), self._seconds_to_human_string(self.tool_statistics[tool_id]['time_heater_standby']))
-                msg += "\n------------\n"
-                
+                        parts.append(" %s with active heater and %s with standby heater." % (self._seconds_to_human_string(ts.time_heater_active), self._seconds_to_human_string(ts.time_heater_standby)))
+                parts.append("\n------------\n")
 
-        self.always(msg)
+            self.always("".join(parts))
 
     def _dump_print_statistics(self, report=False):
-        if self.log_statistics or report:
-            msg = "ToolChanger Statistics for this print:\n"
-            msg += self._swap_print_statistics_to_human_string()
-            msg += "\n------------\n"
-
-            msg += "Tool Statistics for this print:\n"
+        # The statistics dumps are only built when they are going to be output.
+        if (self.log_statistics or report) and self._info_enabled:
+            parts = ["ToolChanger Statistics for this print:\n",
+                     self._swap_print_statistics_to_human_string(),
+                     "\n------------\nTool Statistics for this print:\n"]
 
-            # First convert to int so we get right order.
-            res = {int(k):v for k,v in self.tool_statistics.items()}
-            for tid in res:
-                tool_id= str(tid)
+            for tool_id in self._sorted_tool_ids:
                 ts = self.tool_statistics[tool_id]
                 pts = self.print_tool_statistics[tool_id]
-                msg += "Tool#%s:\n" % (tool_id)
-                msg += "Completed %d out of %d mounts in %s. Average of %s per toolmount.\n" % ((ts['toolmounts_completed']-pts['toolmounts_completed']), (ts['toolmounts_started']-pts['toolmounts_started']), self._seconds_to_human_string(ts['total_time_spent_mounting']-pts['total_time_spent_mounting']), self._seconds_to_human_string(self._division((ts['total_time_spent_mounting']-pts['total_time_spent_mounting']), (ts['toolmounts_completed']-ts['toolmounts_completed']))))
-                msg += "Completed %d out of %d unmounts in %s. Average of %s per toolunmount.\n" % (ts['toolunmounts_completed']-pts['toolunmounts_completed'], ts['toolunmounts_started']-pts['toolunmounts_started'], self._seconds_to_human_string(ts['total_time_spent_unmounting']-pts['total_time_spent_unmounting']), self._seconds_to_human_string(self._division(ts['total_time_spent_unmounting']-pts['total_time_spent_unmounting'], ts['toolunmounts_completed']-pts['toolunmounts_completed'])))
-                msg += "%s spent selected. %s with active heater and %s with standby heater.\n" % (self._seconds_to_human_string(ts['time_selected']-pts['time_selected']), self._seconds_to_human_string(ts['time_heater_active']-pts['time_heater_active']), self._seconds_to_human_string(ts['time_heater_standby']-pts['time_heater_standby']))
-                msg += "------------\n"
-        self.always(msg)
+                parts.append("Tool#%s:\n" % (tool_id))
+                parts.append(self.TOOL_MOUNTS_FORMAT % ((ts.toolmounts_completed-pts.toolmounts_completed), (ts.toolmounts_started-pts.toolmounts_started), self._seconds_to_human_string(ts.total_time_spent_mounting-pts.total_time_spent_mounting), self._seconds_to_human_string(self._division((ts.total_time_spent_mounting-pts.total_time_spent_mounting), (ts.toolmounts_completed-pts.toolmounts_completed)))))
+                parts.append(self.TOOL_UNMOUNTS_FORMAT % (ts.toolunmounts_completed-pts.toolunmounts_completed, ts.toolunmounts_started-pts.toolunmounts_started, self._seconds_to_human_string(ts.total_time_spent_unmounting-pts.total_time_spent_unmounting), self._seconds_to_human_string(self._division(ts.total_time_spent_unmounting-pts.total_time_spent_unmounting, ts.toolunmounts_completed-pts.toolunmounts_completed))))
+                parts.append("%s spent selected. %s with active heater and %s with standby heater.\n------------\n" % (self._seconds_to_human_string(ts.time_selected-pts.time_selected), self._seconds_to_human_string(ts.time_heater_active-pts.time_heater_active), self._seconds_to_human_string(ts.time_heater_standby-pts.time_heater_standby)))
+            self.always("".join(parts))
 
 
 
-    def _persist_swap_statistics(self):
-        swap_stats = {
+    def _get_swap_statistics(self):
+        return {
             # 'total_mounts': self.total_mounts,
             'total_time_spent_mounting': round(self.total_time_spent_mounting, 1),
             'total_time_spent_unmounting': round(self.total_time_spent_unmounting, 1),
@@ -484,84 +633,110 @@ class KtccLog:
             'total_toolmounts': self.total_toolmounts,
             'total_toolunmounts': self.total_toolunmounts
             }
-        self.toolhead.wait_moves()
-        self.gcode.run_script_from_command("SAVE_VARIABLE VARIABLE=%s VALUE=\"%s\"" % ("ktcc_statistics_swaps", swap_stats))
 
-    def _persist_tool_statistics(self):
-        for tool in self.tool_statistics:
-            try:
-                self.toolhead.wait_moves()
-                self.gcode.run_script_from_command("SAVE_VARIABLE VARIABLE=%s%s VALUE=\"%s\"" % (self.KTCC_TOOL_STATISTICS_PREFIX, tool, self.tool_statistics[tool]))
-            except Exception as err:
-                self.debug("Unexpected error in _persist_tool_statistics: %s" % err)
+    # Persist the swap statistics if asked and the statistics of the given tools
+    # with one write of the variables file, waiting for moves only once.
+    def _persist_statistics(self, swap_statistics, tools):
+        variables = {}
+        if swap_statistics:
+            variables["ktcc_statistics_swaps"] = self._get_swap_statistics()
+        for tool in tools:
+            variables["%s%s" % (self.KTCC_TOOL_STATISTICS_PREFIX, tool)] = self.tool_statistics[tool].as_dict()
+        if not variables:
+            return
+        self.toolhead.wait_moves()
+        self._save_variables(variables)
+
+    def _mark_swap_statistics_dirty(self):
+        self._dirty_mask |= self.DIRTY_SWAP_STATISTICS
+        self._swap_statistics_epoch += 1
+
+    def _mark_tool_statistics_dirty(self, tool):
+        self._dirty_tools.add(tool)
+        self._dirty_mask |= self.DIRTY_TOOL_STATISTICS
+
+    def _save_variables(self, variables):
+        # SAVE_VARIABLE writes the whole variables file each time. Stage all but
+        # the last value in memory so a single SAVE_VARIABLE persists them all.
+        save_variables = self.printer.lookup_object('save_variables')
+        items = list(variables.items())
+        for name, value in items[:-1]:
+            save_variables.allVariables[name] = value
+        name, value = items[-1]
+        save_variables.cmd_SAVE_VARIABLE(self.gcode.create_gcode_command(
+            "SAVE_VARIABLE", "SAVE_VARIABLE", {"VARIABLE": name, 'VALUE': value}))
 
     def increase_tool_statistics(self, tool_id, key, count=1):
         try:
-            self.trace("increase_tool_statistics: Running for Tool: %s. Provided to record tool stats while key: %s and count: %s" % (tool_id, str(key), str(count)))
-            # if self.tool_statistics.get(str(tool_id)) is not None:
-            if str(tool_id) in self.tool_statistics:
-                if self.tool_statistics[str(tool_id)][key] is None:
-                    self.tool_statistics[str(tool_id)][key]=0
-                # self.trace("increase_tool_statistics: Before running for Tool: %s. Key: %s is: %s" % (tool_id, str(key), str(self.tool_statistics[str(tool_id)][key])))
-                if isinstance(count, float):
-                    self.tool_statistics[str(tool_id)][key] = round(self.tool_statistics[str(tool_id)][key] + count, 3)
+            self.trace("increase_tool_statistics: Running for Tool: %s. Provided to record tool stats while key: %s and count: %s", tool_id, key, count)
+            tool = str(tool_id)
+            tool_stat = self.tool_statistics.get(tool)
+            if tool_stat is not None:
+                # self.trace("increase_tool_statistics: Before running for Tool: %s. Key: %s is: %s" % (tool_id, str(key), str(getattr(tool_stat, key))))
+                value = getattr(tool_stat, key) or 0
+                if key in KtccToolStatistics.TIME_FIELDS:
+                    setattr(tool_stat, key, round(value + count, 3))
                 else:
-                    self.tool_statistics[str(tool_id)][key] += count
-                # self.trace("increase_tool_statistics: After running for Tool: %s. Key: %s is: %s" % (tool_id, str(key), str(self.tool_statistics[str(tool_id)][key])))
+                    setattr(tool_stat, key, value + count)
+                self._mark_tool_statistics_dirty(tool)
+                # self.trace("increase_tool_statistics: After running for Tool: %s. Key: %s is: %s" % (tool_id, str(key), str(getattr(tool_stat, key))))
             else:
-                self.debug("increase_tool_statistics: Unknown tool provided to record tool stats: %s" % tool_id)
+                self.debug("increase_tool_statistics: Unknown tool provided to record tool stats: %s", tool_id)
                 # self.debug(str(self.tool_statistics))
         except Exception as e:
-            self.debug("Exception whilst tracking tool stats: %s" % str(e))
-            self.debug("increase_tool_statistics: Error while tool: %s provided to record tool stats while key: %s and count: %s" % (tool_id, str(key), str(count)))
+            self.debug("Exception whilst tracking tool stats: %s", e)
+            self.debug("increase_tool_statistics: Error while tool: %s provided to record tool stats while key: %s and count: %s", tool_id, key, count)
         # self.trace("increase_tool_statistics: Tool: %s provided to record tool stats while key: %s and count: %s" % (tool_id, str(key), str(count)))
 
     def _set_tool_statistics(self, tool_id, key, value):
-        self.trace("_set_tool_statistics:Running for Tool: %s provided to record tool stats while key: %s and value: %s" % (tool_id, str(key), str(value)))
+        self.trace("_set_tool_statistics:Running for Tool: %s provided to record tool stats while key: %s and value: %s", tool_id, key, value)
         try:
-            if str(tool_id) in self.tool_statistics:
-                self.tool_statistics[str(tool_id)][key] = value
+            tool_stat = self.tool_statistics.get(str(tool_id))
+            if tool_stat is not None:
+                setattr(tool_stat, key, value)
             else:
-                self.debug("_set_tool_statistics: Unknown tool: %s provided to record tool stats while key: %s and value: %s" % (tool_id, str(key), str(value)))
+                self.debug("_set_tool_statistics: Unknown tool: %s provided to record tool stats while key: %s and value: %s", tool_id, key, value)
         except Exception as e:
-            self.debug("Exception whilst tracking tool stats: %s" % str(e))
-            self.debug("_set_tool_statistics: Error while tool: %s provided to record tool stats while key: %s and value: %s" % (tool_id, str(key), str(value)))
+            self.debug("Exception whilst tracking tool stats: %s", e)
+            self.debug("_set_tool_statistics: Error while tool: %s provided to record tool stats while key: %s and value: %s", tool_id, key, value)
         # self.trace("_set_tool_statistics: Tool: %s provided to record tool stats while key: %s and value: %s" % (tool_id, str(key), str(value)))
 
     def _set_tool_statistics_time_diff(self, tool_id, final_time_key, start_time_key):
         try:
-            if str(tool_id) in self.tool_statistics:
-                tool_stat= self.tool_statistics[str(tool_id)]
-                if tool_stat[start_time_key] is not None and tool_stat[start_time_key] != 0:
-                    # self.trace("_set_tool_statistics_time_diff: Tool: %s value before running: final_time_key: %s=%s, start_time_key: %s=%s." % (tool_id, final_time_key, str(tool_stat[final_time_key]), start_time_key, str(tool_stat[start_time_key])))
-                    if tool_stat[final_time_key] is not None and tool_stat[final_time_key] != 0:
-                        tool_stat[final_time_key] += time.time() - tool_stat[start_time_key]
-                    else:
-                        tool_stat[final_time_key] = time.time() - tool_stat[start_time_key]
-                    tool_stat[start_time_key] = 0
+            tool = str(tool_id)
+            tool_stat = self.tool_statistics.get(tool)
+            if tool_stat is not None:
+                start_time = getattr(tool_stat, start_time_key)
+                if start_time:
+                    # self.trace("_set_tool_statistics_time_diff: Tool: %s value before running: final_time_key: %s=%s, start_time_key: %s=%s." % (tool_id, final_time_key, str(getattr(tool_stat, final_time_key)), start_time_key, str(start_time)))
+                    setattr(tool_stat, final_time_key, (getattr(tool_stat, final_time_key) or 0) + time.monotonic() - start_time)
+                    setattr(tool_stat, start_time_key, 0)
+                    self._mark_tool_statistics_dirty(tool)
             else:
-                self.debug("_set_tool_statistics_time_diff: Unknown tool: %s provided to record tool stats while final_time_key: %s and start_time_key: %s" % (tool_id, str(final_time_key), str(start_time_key)))
+                self.debug("_set_tool_statistics_time_diff: Unknown tool: %s provided to record tool stats while final_time_key: %s and start_time_key: %s", tool_id, final_time_key, start_time_key)
         except Exception as e:
-            self.debug("Exception whilst tracking tool stats: %s" % str(e))
-            self.debug("_set_tool_statistics_time_diff: Error while tool: %s provided to record tool stats while final_time_key: %s and start_time_key: %s" % (tool_id, str(final_time_key), str(start_time_key)))
-        # self.trace("_set_tool_statistics_time_diff: Tool: %s value after running: final_time_key: %s=%s, start_time_key: %s=%s." % (tool_id, final_time_key, str(tool_stat[final_time_key]), start_time_key, str(tool_stat[start_time_key])))
+            self.debug("Exception whilst tracking tool stats: %s", e)
+            self.debug("_set_tool_statistics_time_diff: Error while tool: %s provided to record tool stats while final_time_key: %s and start_time_key: %s", tool_id, final_time_key, start_time_key)
+        # self.trace("_set_tool_statistics_time_diff: Tool: %s value after running: final_time_key: %s=%s, start_time_key: %s=%s." % (tool_id, final_time_key, str(getattr(tool_stat, final_time_key)), start_time_key, str(getattr(tool_stat, start_time_key))))
 
 ### LOGGING AND STATISTICS FUNCTIONS GCODE FUNCTIONS
 
     cmd_KTCC_RESET_STATS_help = "Reset the KTCC statistics"
+    RESET_STATS_CONFIRM_MSG = ("Are you sure you want to reset KTCC statistics?\n"
+                               "If so, run with parameter SURE=YES:\n"
+                               "KTCC_RESET_STATS SURE=YES")
     def cmd_KTCC_RESET_STATS(self, gcmd):
         param = gcmd.get('SURE', "no")
         if param.lower() == "yes":
             self._reset_statistics()
             self._reset_print_statistics()
-            self.changes_to_save = True
+            self._mark_swap_statistics_dirty()
+            for tool in self.tool_statistics:
+                self._mark_tool_statistics_dirty(tool)
             self._dump_statistics(True)
             self.always("Statistics RESET.")
         else:
-            message = "Are you sure you want to reset KTCC statistics?\n"
-            message += "If so, run with parameter SURE=YES:\n"
-            message += "KTCC_RESET_STATS SURE=YES"
-            self.gcode.respond_info(message)
+            self.gcode.respond_info(self.RESET_STATS_CONFIRM_MSG)
 
     cmd_KTCC_DUMP_STATS_help = "Dump the KTCC statistics"
     def cmd_KTCC_DUMP_STATS(self, gcmd):
@@ -581,25 +756,37 @@ class KtccLog:
         self.logfile_level = gcmd.get_int('LOGFILE', self.logfile_level, minval=0, maxval=4)
         self.log_visual = gcmd.get_int('VISUAL', self.log_visual, minval=0, maxval=2)
         self.log_statistics = gcmd.get_int('STATISTICS', self.log_statistics, minval=0, maxval=1)
+        self._update_log_gates()
+
+    # MSG is logged as is, so read it straight from the parsed parameters
+    # instead of going through the checks of gcmd.get().
+    def _get_msg(self, gcmd):
+        return gcmd.get_command_parameters().get('MSG', '')
 
     cmd_KTCC_LOG_ALWAYS_help = "Log allways MSG"
     def cmd_KTCC_LOG_ALWAYS(self, gcmd):
-        msg = gcmd.get('MSG')
+        msg = self._get_msg(gcmd)
         self.always(msg)
 
     cmd_KTCC_LOG_INFO_help = "Log info MSG"
     def cmd_KTCC_LOG_INFO(self, gcmd):
-        msg = gcmd.get('MSG')
+        if not self._info_enabled:
+            return
+        msg = self._get_msg(gcmd)
         self.info(msg)
 
     cmd_KTCC_LOG_DEBUG_help = "Log debug MSG"
     def cmd_KTCC_LOG_DEBUG(self, gcmd):
-        msg = gcmd.get('MSG')
+        if not self._debug_enabled:
+            return
+        msg = self._get_msg(gcmd)
         self.debug(msg)
 
     cmd_KTCC_LOG_TRACE_help = "Log trace MSG"
     def cmd_KTCC_LOG_TRACE(self, gcmd):
-        msg = gcmd.get('MSG')
+        if not self._trace_enabled:
+            return
+        msg = self._get_msg(gcmd)
         self.trace(msg)
 
     # def _get_print_status(self):
@@ -607,7 +794,7 @@ class KtccLog:
     #         # If using virtual sdcard this is the most reliable method
     #         source = "print_stats"
     #         print_status = self.printer.lookup_object("print_stats").get_status(self.printer.get_reactor().monotonic())['state']
-    #     except:
+    #     except Exception:
     #         # Otherwise we fallback to idle_timeout
     #         source = "idle_timeout"
     #         if self.printer.lookup_object("pause_resume").is_paused:
@@ -618,9 +805,8 @@ class KtccLog:
     #                 print_status = "standby"
     #             else:
     #                 print_status = idle_timeout['state'].lower()
-    #     finally:
-    #         self.trace("Determined print status as: %s from %s" % (print_status, source))
-    #         return print_status
+    #     self.trace("Determined print status as: %s from %s", print_status, source)
+    #     return print_status
 
 
     # cmd_KTCC_STATUS_help = "Complete dump of current KTCC state and important configuration"
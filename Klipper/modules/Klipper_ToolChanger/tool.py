@@ -14,19 +14,33 @@
 # ToolUnLock: Toollock is disengaged.
 
 # KTCC exception error class
-# class KTCCError(Exception):
-#     pass
+class KTCCError(Exception):
+    pass
+
+# Heater states. Module level so set_heater can compare against them without attribute lookups on self.
+HEATER_STATE_ACTIVE = 2
+HEATER_STATE_STANDBY = 1
+HEATER_STATE_OFF = 0
 
 # Each tool is getting an instance of this.
-import logging
 from .toollock import parse_restore_type
+from .gcode_macro import GetStatusWrapper
 
 class Tool:
     TOOL_UNKNOWN = -2
     TOOL_UNLOCKED = -1
-    HEATER_STATE_ACTIVE = 2
-    HEATER_STATE_STANDBY = 1
-    HEATER_STATE_OFF = 0
+    HEATER_STATE_ACTIVE = HEATER_STATE_ACTIVE
+    HEATER_STATE_STANDBY = HEATER_STATE_STANDBY
+    HEATER_STATE_OFF = HEATER_STATE_OFF
+
+    _tool_cache = {}                        # Tool id -> Tool object, filled as tools are created or first looked up.
+
+    # set_offset keyword -> (offset index, True if the value is added to the current offset).
+    _OFFSET_OPS = {
+        "x_pos": (0, False), "x_adjust": (0, True),
+        "y_pos": (1, False), "y_adjust": (1, True),
+        "z_pos": (2, False), "z_adjust": (2, True),
+    }
 
     def __init__(self, config = None):
         self.name = None
@@ -47,8 +61,8 @@ class Tool:
         self.virtual_toolload_gcode = None  # The plain gcode string is to load for virtual tool having this tool as parent. This is for loading the virtual tool.
         self.virtual_toolunload_gcode = None# The plain gcode string is to unload for virtual tool having this tool as parent. This is for unloading the virtual tool.
 
-#        self.timer_idle_to_standby = None
-#        self.timer_idle_to_powerdown = None
+        self._timer_idle_to_standby = None  # Created on first use, see the timer_idle_to_* properties.
+        self._timer_idle_to_powerdown = None
 
         self.requires_pickup_for_virtual_load = None   # May be needed for a filament swap to prevent ooze but not for a pen.
         self.requires_pickup_for_virtual_unload = None # May be needed for a filament swap to prevent ooze but not for a pen. Used when forcing unload.
@@ -62,6 +76,11 @@ class Tool:
         self.idle_to_standby_time = None    # Time in seconds from being parked to setting temperature to standby the temperature above. Use 0.1 to change imediatley to standby temperature. Requred on Physical tool
         self.idle_to_powerdown_time = None  # Time in seconds from being parked to setting temperature to 0. Use something like 86400 to wait 24h if you want to disable. Requred on Physical tool.
 
+        self._template_contexts = {}        # Template -> context skeleton holding its constant action_* entries.
+        self._status_cache = None           # Cached get_status() dict, cleared whenever a status field changes.
+        self._config_memo = {}              # Raw config values already looked up through get_config().
+        self._heater = None                 # Heater of the extruder, looked up once at klippy:connect.
+
         # Tool specific input shaper parameters. Initiated as Klipper standard.
         self.shaper_freq_x = 0
         self.shaper_freq_y = 0
@@ -69,6 +88,7 @@ class Tool:
         self.shaper_type_y = "mzv"
         self.shaper_damping_ratio_x = 0.1
         self.shaper_damping_ratio_y = 0.1
+        self._shaper_cmd = None             # Prebuilt SET_INPUT_SHAPER command, None if no shaper_freq is set.
 
         self.config = config
 
@@ -81,6 +101,7 @@ class Tool:
 
         # Load used objects.
         self.printer = config.get_printer()
+        self.reactor = self.printer.get_reactor()
         self.gcode = self.printer.lookup_object('gcode')
         self.gcode_macro = self.printer.load_object(config, 'gcode_macro')
         self.toollock = self.printer.lookup_object('toollock')
@@ -117,7 +138,7 @@ class Tool:
             self.physical_parent_id = self.TOOL_UNLOCKED
 
         if self.physical_parent_id >= 0 and not self.physical_parent_id == self.name:
-            self.pp = self.printer.lookup_object("tool " + str(self.physical_parent_id))
+            self.pp = self._lookup_tool(self.physical_parent_id)
         else:
             self.pp = Tool()     # Initialize physical parent as a dummy object.
 
@@ -144,19 +165,20 @@ class Tool:
         ##### Coordinates #####
         try:
             self.zone = config.get('zone', pp_status['zone'])
-            if not isinstance(self.zone, list):
+            if not isinstance(self.zone, (list, tuple)):
                 self.zone = str(self.zone).split(',')
             self.park = config.get('park', pp_status['park'])                  
-            if not isinstance(self.park, list):
+            if not isinstance(self.park, (list, tuple)):
                 self.park = str(self.park).split(',')
             self.offset = config.get('offset', pp_status['offset'])
-            if not isinstance(self.offset, list):
+            if not isinstance(self.offset, (list, tuple)):
                 self.offset = str(self.offset).split(',')
 
-            # Remove any accidental blank spaces.
-            self.zone = [s.strip() for s in self.zone]
-            self.park = [s.strip() for s in self.park]
-            self.offset = [s.strip() for s in self.offset]
+            # Parse once to floats, which also drops any accidental blank spaces.
+            # Offset stays a list of its own as set_offset changes it.
+            self.zone = tuple(float(s) for s in self.zone)
+            self.park = tuple(float(s) for s in self.park)
+            self.offset = [float(s) for s in self.offset]
 
             if len(self.zone) < 3:
                 raise config.error("zone Offset is malformed, must be a list of x,y,z If you want it blank, use 0,0,0")
@@ -177,6 +199,13 @@ class Tool:
         self.shaper_type_y = config.get('shaper_type_y', pp_status['shaper_type_y'])                     
         self.shaper_damping_ratio_x = config.get('shaper_damping_ratio_x', pp_status['shaper_damping_ratio_x'])                     
         self.shaper_damping_ratio_y = config.get('shaper_damping_ratio_y', pp_status['shaper_damping_ratio_y'])                     
+        # The shaper parameters never change after config, so build the deprecated command once.
+        if self.shaper_freq_x != 0 or self.shaper_freq_y != 0:
+            self._shaper_cmd = (
+                "SET_INPUT_SHAPER SHAPER_FREQ_X=%s SHAPER_FREQ_Y=%s DAMPING_RATIO_X=%s DAMPING_RATIO_Y=%s SHAPER_TYPE_X=%s SHAPER_TYPE_Y=%s" %
+                (self.shaper_freq_x, self.shaper_freq_y,
+                 self.shaper_damping_ratio_x, self.shaper_damping_ratio_y,
+                 self.shaper_type_x, self.shaper_type_y))
 
         ##### Standby settings (if the tool has an extruder) #####
         if self.extruder is not None:
@@ -190,14 +219,9 @@ class Tool:
             if self.idle_to_powerdown_time is None:
                 self.idle_to_powerdown_time = self.toolgroup.idle_to_powerdown_time
 
-            # For all virtual tools that are not also a physical parent, use physical parent's timer.
-            if self.physical_parent_id > self.TOOL_UNLOCKED and self.physical_parent_id != self.name:
-                self.timer_idle_to_standby = self.pp.get_timer_to_standby()
-                self.timer_idle_to_powerdown = self.pp.get_timer_to_powerdown()
-            else:
-                # Set up new timers if physical tool.
-                self.timer_idle_to_standby = ToolStandbyTempTimer(self.printer, self.name, ToolStandbyTempTimer.TIMER_TO_STANDBY)
-                self.timer_idle_to_powerdown = ToolStandbyTempTimer(self.printer, self.name, ToolStandbyTempTimer.TIMER_TO_SHUTDOWN)
+            # The standby timers are only set up when the tool's heater is first used.
+
+            self.printer.register_event_handler("klippy:connect", self._handle_connect)
 
         ##### G-Code ToolChange #####
         self.pickup_gcode_template = self._get_gcode_template_with_inheritence('pickup_gcode')
@@ -224,10 +248,24 @@ class Tool:
             if self.unload_virtual_at_dropoff is None:
                 self.unload_virtual_at_dropoff = self.toolgroup.unload_virtual_at_dropoff
 
-        logging.warn("T%s unload_virtual_at_dropoff: %s" % (str(self.name), str(self.requires_pickup_for_virtual_load)))
+        self.log.debug("T%d unload_virtual_at_dropoff: %s", self.name, self.unload_virtual_at_dropoff)
             
         ##### Register Tool select command #####
-        self.gcode.register_command("T" + str(self.name), self.cmd_SelectTool, desc=self.cmd_SelectTool_help)
+        self.gcode.register_command("T%d" % self.name, self.cmd_SelectTool, desc=Tool.cmd_SelectTool_help)
+
+        Tool._tool_cache[self.name] = self
+
+    # Return the Tool object for a tool id without going through the printer object registry each time.
+    def _lookup_tool(self, tool_id):
+        tool = Tool._tool_cache.get(tool_id)
+        # Entries left over from before a Klipper restart belong to the old printer object.
+        if tool is None or tool.printer is not self.printer:
+            tool = self.printer.lookup_object('tool ' + str(tool_id))
+            Tool._tool_cache[tool_id] = tool
+        return tool
+
+    def _handle_connect(self):
+        self._heater = self.printer.lookup_object(self.extruder).get_heater()
 
     def _get_bool_config_parameter_with_inheritence(self, config_param, default = None):
         tmp = self.config.getboolean(config_param, self.pp.get_config(config_param))   
@@ -253,23 +291,41 @@ class Tool:
         template = self.gcode_macro.load_template(self.config, config_param, temp_gcode)
         return template
 
+    # Build the context for running one of this tool's gcode templates.
+    # The action_* entries never change so they are only created once per template, but 'printer'
+    # caches the status it hands out and must be fresh for every run.
+    def _create_template_context(self, template):
+        skeleton = self._template_contexts.get(template)
+        if skeleton is None:
+            skeleton = template.create_template_context()
+            self._template_contexts[template] = skeleton
+        context = dict(skeleton)
+        context['printer'] = GetStatusWrapper(self.printer)
+        context['myself'] = self.get_status()
+        context['toollock'] = self.toollock.get_status()
+        return context
+
+    # Virtual tools inherit through their physical parent, so the same parameters get asked for once per child.
     def get_config(self, config_param, default = None):
         if self.config is None: return None
-        return self.config.get(config_param, default)
+        if config_param not in self._config_memo:
+            self._config_memo[config_param] = self.config.get(config_param, None)
+        value = self._config_memo[config_param]
+        return default if value is None else value
         
     cmd_SelectTool_help = "Select Tool"
     def cmd_SelectTool(self, gcmd):
-        self.log.trace("KTCC T" + str(self.name) + " Selected.")
+        self.log.trace("KTCC T%d Selected.", self.name)
         # Allow either one.
         restore_mode = parse_restore_type(gcmd, 'R', None)
         restore_mode = parse_restore_type(gcmd, 'RESTORE_POSITION_TYPE', restore_mode)
 
         # Check if the requested tool has been remaped to another one.
-        tool_is_remaped = self.toollock.tool_is_remaped(int(self.name))
+        tool_is_remaped = self.toollock.tool_is_remaped(self.name)
 
         if tool_is_remaped > -1:
             self.log.always("Tool %d is remaped to Tool %d" % (self.name, tool_is_remaped))
-            remaped_tool = self.printer.lookup_object('tool ' + str(tool_is_remaped))
+            remaped_tool = self._lookup_tool(tool_is_remaped)
             remaped_tool.select_tool_actual(restore_mode)
             return
         else:
@@ -290,6 +346,20 @@ class Tool:
             msg = "TOOL_PICKUP: Unknown tool already mounted Can't park it before selecting new tool."
             self.log.always(msg)
             raise self.printer.command_error(msg)
+
+        same_phys = False                                     # If the current tool is on the same physical tool as this one.
+        if current_tool_id > self.TOOL_UNLOCKED:
+            current_tool = self._lookup_tool(current_tool_id)
+            same_phys = (self.physical_parent_id > self.TOOL_UNLOCKED and
+                         self.physical_parent_id == current_tool.get_status()["physical_parent_id"])
+
+            # If this virtual tool is already the one loaded in the mounted physical tool there is nothing to
+            # drop, heat or load. Just make it the selected tool.
+            if same_phys and self.is_virtual and self._lookup_tool(self.physical_parent_id).virtual_loaded == self.name:
+                self.log.track_selected_tool_end(current_tool_id)
+                self.toollock.SaveCurrentTool(self.name)
+                self.log.track_selected_tool_start(self.name)
+                return
         
         self.log.increase_tool_statistics(self.name, 'toolmounts_started')
 
@@ -307,13 +377,8 @@ class Tool:
         if current_tool_id > self.TOOL_UNLOCKED:              # If there is a current tool already selected and it's a known tool.
             self.log.track_selected_tool_end(current_tool_id) # Log that the current tool is to be unmounted.
 
-            current_tool = self.printer.lookup_object('tool ' + str(current_tool_id))
-           
             # If the next tool is not another virtual tool on the same physical tool.
-            if int(self.physical_parent_id ==  self.TOOL_UNLOCKED or 
-                        self.physical_parent_id) !=  int( 
-                        current_tool.get_status()["physical_parent_id"]
-                        ):
+            if not same_phys:
                 self.log.info("Will Dropoff():%s" % str(current_tool_id))
                 current_tool.Dropoff()
                 current_tool_id = self.TOOL_UNLOCKED
@@ -327,24 +392,23 @@ class Tool:
 
         # Check if this is a virtual tool.
         if not self.is_virtual:
-            self.log.trace("cmd_SelectTool: T%s - Not Virtual - Pickup" % str(self.name))
+            self.log.trace("cmd_SelectTool: T%d - Not Virtual - Pickup", self.name)
             self.Pickup()
         else:
             if current_tool_id > self.TOOL_UNLOCKED:                 # If still has a selected tool: (This tool is a virtual tool with same physical tool as the last)
-                current_tool = self.printer.lookup_object('tool ' + str(current_tool_id))
-                self.log.trace("cmd_SelectTool: T" + str(self.name) + "- Virtual - Physical Tool is not Dropped - ")
-                if self.physical_parent_id > self.TOOL_UNLOCKED and self.physical_parent_id == current_tool.get_status()["physical_parent_id"]:
-                    self.log.trace("cmd_SelectTool: T" + str(self.name) + "- Virtual - Same physical tool - Pickup")
+                self.log.trace("cmd_SelectTool: T%d- Virtual - Physical Tool is not Dropped - ", self.name)
+                if same_phys:
+                    self.log.trace("cmd_SelectTool: T%d- Virtual - Same physical tool - Pickup", self.name)
                     self.LoadVirtual()
                 else:
-                    msg = "cmd_SelectTool: T" + str(self.name) + "- Virtual - Not Same physical tool"
+                    msg = "cmd_SelectTool: T%d- Virtual - Not Same physical tool" % self.name
                     msg += "Shouldn't reach this because it is dropped in previous."
                     self.log.debug(msg)
-                    raise Exception(msg)
+                    raise KTCCError(msg)
             else: # New Physical tool with a virtual tool.
-                pp = self.printer.lookup_object('tool ' + str(self.physical_parent_id))
+                pp = self._lookup_tool(self.physical_parent_id)
                 pp_virtual_loaded = pp.get_status()["virtual_loaded"]
-                self.log.trace("cmd_SelectTool: T" + str(self.name) + "- Virtual - Picking upp physical tool")
+                self.log.trace("cmd_SelectTool: T%d- Virtual - Picking upp physical tool", self.name)
                 self.Pickup()
 
                 # If the new physical tool already has another virtual tool loaded:
@@ -352,9 +416,9 @@ class Tool:
                     if pp_virtual_loaded != self.name:
                         self.log.info("cmd_SelectTool: T" + str(pp_virtual_loaded) + "- Virtual - Running UnloadVirtual")
 
-                        uv= self.printer.lookup_object('tool ' + str(pp_virtual_loaded))
+                        uv= self._lookup_tool(pp_virtual_loaded)
                         if uv.extruder is not None:               # If the new tool to be selected has an extruder prepare warmup before actual tool change so all unload commands will be done while heating up.
-                            curtime = self.printer.get_reactor().monotonic()
+                            curtime = self.reactor.monotonic()
                             # heater = self.printer.lookup_object(self.extruder).get_heater()
 
                             uv.set_heater(heater_state = self.HEATER_STATE_ACTIVE)
@@ -364,10 +428,12 @@ class Tool:
                         self.set_heater(heater_state = self.HEATER_STATE_ACTIVE)
 
 
-                self.log.trace("cmd_SelectTool: T" + str(self.name) + "- Virtual - Picked up physical tool and now Loading virtual tool.")
+                self.log.trace("cmd_SelectTool: T%d- Virtual - Picked up physical tool and now Loading virtual tool.", self.name)
                 self.LoadVirtual()
 
-        self.toollock.SaveCurrentTool(self.name)
+        # Pickup already saves the tool as soon as it is mounted, so only a virtual swap on the same physical tool is left to save.
+        if self.toollock.tool_current != str(self.name):
+            self.toollock.SaveCurrentTool(self.name)
         self.log.track_selected_tool_start(self.name)
 
 
@@ -376,7 +442,7 @@ class Tool:
 
         # Check if homed
         if not self.toollock.PrinterIsHomedForToolchange():
-            raise self.printer.command_error("Tool.Pickup: Printer not homed and Lazy homing option for tool %s is: %s" % (str(self.name), str(self.lazy_home_when_parking)))
+            raise self.printer.command_error("Tool.Pickup: Printer not homed and Lazy homing option for tool %d is: %s" % (self.name, self.lazy_home_when_parking))
             return None
 
         # If has an extruder then activate that extruder.
@@ -387,31 +453,27 @@ class Tool:
 
         # Run the gcode for pickup.
         try:
-            context = self.pickup_gcode_template.create_template_context()
-            context['myself'] = self.get_status()
-            context['toollock'] = self.toollock.get_status()
+            context = self._create_template_context(self.pickup_gcode_template)
             self.pickup_gcode_template.run_gcode_from_command(context)
         except Exception as e:
-            raise Exception("Pickup gcode: Script running error: %s" % (str(e)))
+            raise KTCCError("Pickup gcode: Script running error") from e
+
 
+        # Commands to run after the pickup gcode, sent as one script.
+        script = []
 
         # Restore fan if has a fan.
         if self.fan is not None:
-            self.gcode.run_script_from_command(
-                "SET_FAN_SPEED FAN=" + self.fan + " SPEED=" + str(self.toollock.get_status()['saved_fan_speed']))
+            script.append("SET_FAN_SPEED FAN=%s SPEED=%s" % (self.fan, self.toollock.saved_fan_speed))
 
         # Set Tool specific input shaper. -- Deprecated --
-        if self.shaper_freq_x != 0 or self.shaper_freq_y != 0:
+        if self._shaper_cmd is not None:
             self.log.always("shaper_freq will be deprecated. Use SET_INPUT_SHAPER inside the pickup gcode instead.")
-            cmd = ("SET_INPUT_SHAPER" +
-                " SHAPER_FREQ_X=" + str(self.shaper_freq_x) +
-                " SHAPER_FREQ_Y=" + str(self.shaper_freq_y) +
-                " DAMPING_RATIO_X=" + str(self.shaper_damping_ratio_x) +
-                " DAMPING_RATIO_Y=" + str(self.shaper_damping_ratio_y) +
-                " SHAPER_TYPE_X=" + str(self.shaper_type_x) +
-                " SHAPER_TYPE_Y=" + str(self.shaper_type_y) )
-            self.log.trace("Pickup_inpshaper: " + cmd)
-            self.gcode.run_script_from_command(cmd)
+            self.log.trace("Pickup_inpshaper: %s", self._shaper_cmd)
+            script.append(self._shaper_cmd)
+
+        if script:
+            self.gcode.run_script_from_command("\n".join(script))
 
         # Save current picked up tool and print on screen.
         self.toollock.SaveCurrentTool(self.name)
@@ -423,7 +485,7 @@ class Tool:
         self.log.track_mount_end(self.name)             # Log number of toolchanges and the time it takes for tool mounting.
 
     def Dropoff(self, force_virtual_unload = False):
-        self.log.always("Dropoff: T%s - Running." % str(self.name))
+        self.log.always("Dropoff: T%d - Running.", self.name)
 
         self.log.track_selected_tool_end(self.name) # Log that the current tool is to be unmounted.
 
@@ -434,27 +496,24 @@ class Tool:
 
         # Turn off fan if has a fan.
         if self.fan is not None:
-            self.gcode.run_script_from_command(
-                "SET_FAN_SPEED FAN=" + self.fan + " SPEED=0" )
+            self.gcode.run_script_from_command("SET_FAN_SPEED FAN=%s SPEED=0" % self.fan)
 
         # Check if this is a virtual tool.
-        self.log.trace("Dropoff: T" + str(self.name) + "- is_virtual: " + str(self.is_virtual))
+        self.log.trace("Dropoff: T%d- is_virtual: %s", self.name, self.is_virtual)
         if self.is_virtual:
             # Only dropoff if it is required.
             if self.unload_virtual_at_dropoff or force_virtual_unload:
-                self.log.debug("T%s: unload_virtual_at_dropoff: %s, force_virtual_unload: %s" % (str(self.name), str(self.unload_virtual_at_dropoff), str(force_virtual_unload)))
-                self.log.info("Dropoff: T" + str(self.name) + "- Virtual - Running UnloadVirtual")
+                self.log.debug("T%d: unload_virtual_at_dropoff: %s, force_virtual_unload: %s", self.name, self.unload_virtual_at_dropoff, force_virtual_unload)
+                self.log.info("Dropoff: T%d- Virtual - Running UnloadVirtual", self.name)
                 self.UnloadVirtual()
 
         self.log.track_unmount_start(self.name)                 # Log the time it takes for tool change.
         # Run the gcode for dropoff.
         try:
-            context = self.dropoff_gcode_template.create_template_context()
-            context['myself'] = self.get_status()
-            context['toollock'] = self.toollock.get_status()
+            context = self._create_template_context(self.dropoff_gcode_template)
             self.dropoff_gcode_template.run_gcode_from_command(context)
         except Exception as e:
-            raise Exception("Dropoff gcode: Script running error: %s" % (str(e)))
+            raise KTCCError("Dropoff gcode: Script running error") from e
 
         self.toollock.SaveCurrentTool(self.TOOL_UNLOCKED)   # Dropoff successfull
         self.log.track_unmount_end(self.name)                 # Log the time it takes for tool change.
@@ -466,24 +525,22 @@ class Tool:
 
         # Run the gcode for Virtual Load.
         try:
-            context = self.virtual_toolload_gcode_template.create_template_context()
-            context['myself'] = self.get_status()
-            context['toollock'] = self.toollock.get_status()
+            context = self._create_template_context(self.virtual_toolload_gcode_template)
             self.virtual_toolload_gcode_template.run_gcode_from_command(context)
         except Exception as e:
-            raise Exception("virtual_toolload_gcode: Script running error: %s" % (str(e)))
+            raise KTCCError("virtual_toolload_gcode: Script running error") from e
 
-        pp = self.printer.lookup_object('tool ' + str(self.physical_parent_id))
-        pp.set_virtual_loaded(int(self.name))
+        pp = self._lookup_tool(self.physical_parent_id)
+        pp.set_virtual_loaded(self.name)
 
-        # Save current picked up tool and print on screen.
-        self.toollock.SaveCurrentTool(self.name)
-        self.log.trace("Virtual T%d Loaded" % (int(self.name)))
+        # The current tool is saved by select_tool_actual once the whole change is done.
+        self.log.trace("Virtual T%d Loaded", self.name)
         self.log.track_mount_end(self.name)             # Log number of toolchanges and the time it takes for tool mounting.
 
     def set_virtual_loaded(self, value = -1):
         self.virtual_loaded = value
-        self.log.trace("Saved VirtualToolLoaded for T%s as: %s" % (str(self.name), str(value)))
+        self._status_cache = None
+        self.log.trace("Saved VirtualToolLoaded for T%d as: %s", self.name, value)
 
 
     def UnloadVirtual(self):
@@ -492,52 +549,47 @@ class Tool:
 
         # Run the gcode for Virtual Unload.
         try:
-            context = self.virtual_toolunload_gcode_template.create_template_context()
-            context['myself'] = self.get_status()
-            context['toollock'] = self.toollock.get_status()
+            context = self._create_template_context(self.virtual_toolunload_gcode_template)
             self.virtual_toolunload_gcode_template.run_gcode_from_command(context)
         except Exception as e:
-            raise Exception("virtual_toolunload_gcode: Script running error:\n%s" % str(e))
+            raise KTCCError("virtual_toolunload_gcode: Script running error") from e
 
-        pp = self.printer.lookup_object('tool ' + str(self.physical_parent_id))
+        pp = self._lookup_tool(self.physical_parent_id)
         pp.set_virtual_loaded(-1)
 
-        # Save current picked up tool and print on screen.
-        self.toollock.SaveCurrentTool(self.name)
-        self.log.trace("Virtual T%d Unloaded" % (int(self.name)))
+        # The physical tool stays mounted, the caller saves whatever tool ends up current.
+        self.log.trace("Virtual T%d Unloaded", self.name)
 
         self.log.track_unmount_end(self.name)                 # Log the time it takes for tool unload. 
 
     def set_offset(self, **kwargs):
-        for i in kwargs:
-            if i == "x_pos":
-                self.offset[0] = float(kwargs[i])
-            elif i == "x_adjust":
-                self.offset[0] = float(self.offset[0]) + float(kwargs[i])
-            elif i == "y_pos":
-                self.offset[1] = float(kwargs[i])
-            elif i == "y_adjust":
-                self.offset[1] = float(self.offset[1]) + float(kwargs[i])
-            elif i == "z_pos":
-                self.offset[2] = float(kwargs[i])
-            elif i == "z_adjust":
-                self.offset[2] = float(self.offset[2]) + float(kwargs[i])
-
-        self.log.always("T%d offset now set to: %f, %f, %f." % (int(self.name), float(self.offset[0]), float(self.offset[1]), float(self.offset[2])))
+        for key, value in kwargs.items():
+            op = self._OFFSET_OPS.get(key)
+            if op is None:
+                continue
+            idx, adjust = op
+            if adjust:
+                self.offset[idx] += float(value)
+            else:
+                self.offset[idx] = float(value)
+        self._status_cache = None
+
+        self.log.always("T%d offset now set to: %f, %f, %f.", self.name, self.offset[0], self.offset[1], self.offset[2])
 
     def _set_state(self, heater_state):
-        self.heater_state = heater_state
+        self.heater_state = int(heater_state)
+        self._status_cache = None
 
 
     def set_heater(self, **kwargs):
         if self.extruder is None:
-            self.log.debug("set_heater: T%d has no extruder! Nothing to do." % self.name )
+            self.log.debug("set_heater: T%d has no extruder! Nothing to do.", self.name)
             return None
 
         # self.log.info("T%d heater is at begingin %s." % (self.name, self.heater_state ))
+        self._status_cache = None           # Temperatures, times and state below may all change.
 
-        heater = self.printer.lookup_object(self.extruder).get_heater()
-        curtime = self.printer.get_reactor().monotonic()
+        heater = self._heater
         changing_timer = False
         
         # self is always pointing to virtual tool but its timers and extruder are always pointing to the physical tool. When changing multiple virtual tools heaters the statistics can remain open when changing by timers of the parent if another one got in between.
@@ -548,77 +600,103 @@ class Tool:
         else:
             tool_for_tracking_heater = self.name
 
+        # The state only changes at the very end, so read it once.
+        current_state = self.heater_state
+
         # First set state if changed, so we set correct temps.
         if "heater_state" in kwargs:
             chng_state = kwargs["heater_state"]
-        for i in kwargs:
-            if i == "heater_active_temp":
-                self.heater_active_temp = kwargs[i]
-                if int(self.heater_state) == self.HEATER_STATE_ACTIVE:
-                    heater.set_temp(self.heater_active_temp)
-            elif i == "heater_standby_temp":
-                self.heater_standby_temp = kwargs[i]
-                if int(self.heater_state) == self.HEATER_STATE_STANDBY:
-                    heater.set_temp(self.heater_standby_temp)
-            elif i == "idle_to_standby_time":
-                self.idle_to_standby_time = kwargs[i]
-                changing_timer = True
-            elif i == "idle_to_powerdown_time":
-                self.idle_to_powerdown_time = kwargs[i]
-                changing_timer = True
+        if "heater_active_temp" in kwargs:
+            self.heater_active_temp = kwargs["heater_active_temp"]
+            if current_state == HEATER_STATE_ACTIVE:
+                heater.set_temp(self.heater_active_temp)
+        if "heater_standby_temp" in kwargs:
+            self.heater_standby_temp = kwargs["heater_standby_temp"]
+            if current_state == HEATER_STATE_STANDBY:
+                heater.set_temp(self.heater_standby_temp)
+        if "idle_to_standby_time" in kwargs:
+            self.idle_to_standby_time = kwargs["idle_to_standby_time"]
+            changing_timer = True
+        if "idle_to_powerdown_time" in kwargs:
+            self.idle_to_powerdown_time = kwargs["idle_to_powerdown_time"]
+            changing_timer = True
 
         # If already in standby and timers are counting down, i.e. have not triggered since set in standby, then reset the ones counting down.
-        if int(self.heater_state) == self.HEATER_STATE_STANDBY and changing_timer:
-            if self.timer_idle_to_powerdown.get_status()["counting_down"] == True:
+        if current_state == HEATER_STATE_STANDBY and changing_timer:
+            if self.timer_idle_to_powerdown.counting_down:
                 self.timer_idle_to_powerdown.set_timer(self.idle_to_powerdown_time, self.name)
-                if self.idle_to_powerdown_time > 2:
-                    self.log.info("T%d heater will shut down in %s seconds." % (self.name, self.log._seconds_to_human_string(self.idle_to_powerdown_time) ))
-            if self.timer_idle_to_standby.get_status()["counting_down"] == True:
+                if self.idle_to_powerdown_time > 2 and self.log.info_enabled:
+                    self.log.info("T%d heater will shut down in %s seconds.", self.name, self.log._seconds_to_human_string(self.idle_to_powerdown_time))
+            if self.timer_idle_to_standby.counting_down:
                 self.timer_idle_to_standby.set_timer(self.idle_to_standby_time, self.name)
-                if self.idle_to_standby_time > 2:
-                    self.log.info("T%d heater will go in standby in %s seconds." % (self.name, self.log._seconds_to_human_string(self.idle_to_standby_time) ))
+                if self.idle_to_standby_time > 2 and self.log.info_enabled:
+                    self.log.info("T%d heater will go in standby in %s seconds.", self.name, self.log._seconds_to_human_string(self.idle_to_standby_time))
 
 
         # Change Active mode, Continuing with part two of temp changing.:
         if "heater_state" in kwargs:
-            if self.heater_state == chng_state:                                                         # If we don't actually change the state don't do anything.
-                if chng_state == self.HEATER_STATE_ACTIVE:
-                    self.log.trace("set_heater: T%d heater state not changed. Setting active temp." % self.name )
+            if current_state == chng_state:                                                         # If we don't actually change the state don't do anything.
+                if chng_state == HEATER_STATE_ACTIVE:
+                    self.log.trace("set_heater: T%d heater state not changed. Setting active temp.", self.name)
                     heater.set_temp(self.heater_active_temp)
-                elif chng_state == self.HEATER_STATE_STANDBY:
-                    self.log.trace("set_heater: T%d heater state not changed. Setting standby temp." % self.name )
+                elif chng_state == HEATER_STATE_STANDBY:
+                    self.log.trace("set_heater: T%d heater state not changed. Setting standby temp.", self.name)
                     heater.set_temp(self.heater_standby_temp)
                 else:
-                    self.log.trace("set_heater: T%d heater state not changed." % self.name )
+                    self.log.trace("set_heater: T%d heater state not changed.", self.name)
                 return None
-            if chng_state == self.HEATER_STATE_OFF:                                                                         # If Change to Shutdown
-                self.log.trace("set_heater: T%d heater state now OFF." % self.name )
+            if chng_state == HEATER_STATE_OFF:                                                                         # If Change to Shutdown
+                self.log.trace("set_heater: T%d heater state now OFF.", self.name)
                 self.timer_idle_to_standby.set_timer(0, self.name)
                 self.timer_idle_to_powerdown.set_timer(0.1, self.name)
                 # self.log.track_standby_heater_end(self.name)                                                # Set the standby as finishes in statistics.
                 # self.log.track_active_heater_end(self.name)                                                # Set the active as finishes in statistics.
-            elif chng_state == self.HEATER_STATE_ACTIVE:                                                                       # Else If Active
-                self.log.trace("set_heater: T%d heater state now ACTIVE." % self.name )
+            elif chng_state == HEATER_STATE_ACTIVE:                                                                       # Else If Active
+                self.log.trace("set_heater: T%d heater state now ACTIVE.", self.name)
                 self.timer_idle_to_standby.set_timer(0, self.name)
                 self.timer_idle_to_powerdown.set_timer(0, self.name)
                 heater.set_temp(self.heater_active_temp)
                 self.log.track_standby_heater_end(tool_for_tracking_heater)                                                # Set the standby as finishes in statistics.
                 self.log.track_active_heater_start(tool_for_tracking_heater)                                               # Set the active as started in statistics.
-            elif chng_state == self.HEATER_STATE_STANDBY:                                                                       # Else If Standby
-                self.log.trace("set_heater: T%d heater state now STANDBY." % self.name )
-                if int(self.heater_state) == self.HEATER_STATE_ACTIVE and int(self.heater_standby_temp) < int(heater.get_status(curtime)["temperature"]):
+            elif chng_state == HEATER_STATE_STANDBY:                                                                       # Else If Standby
+                self.log.trace("set_heater: T%d heater state now STANDBY.", self.name)
+                current_temp = int(heater.get_status(self.reactor.monotonic())["temperature"])
+                if current_state == HEATER_STATE_ACTIVE and int(self.heater_standby_temp) < current_temp:
                     self.timer_idle_to_standby.set_timer(self.idle_to_standby_time, self.name)
                     self.timer_idle_to_powerdown.set_timer(self.idle_to_powerdown_time, self.name)
-                    if self.idle_to_standby_time > 2:
-                        self.log.always("T%d heater will go in standby in %s seconds." % (self.name, self.log._seconds_to_human_string(self.idle_to_standby_time) ))
+                    if self.idle_to_standby_time > 2 and self.log.info_enabled:
+                        self.log.always("T%d heater will go in standby in %s seconds.", self.name, self.log._seconds_to_human_string(self.idle_to_standby_time))
                 else:                                                                                   # Else (Standby temperature is lower than the current temperature)
-                    self.log.trace("set_heater: T%d standbytemp:%d;heater_state:%d; current_temp:%d." % (self.name, int(self.heater_state), int(self.heater_standby_temp), int(heater.get_status(curtime)["temperature"])))
+                    if self.log.trace_enabled:
+                        self.log.trace("set_heater: T%d standbytemp:%d;heater_state:%d; current_temp:%d." % (self.name, current_state, int(self.heater_standby_temp), current_temp))
                     self.timer_idle_to_standby.set_timer(0.1, self.name)
                     self.timer_idle_to_powerdown.set_timer(self.idle_to_powerdown_time, self.name)
-                if self.idle_to_powerdown_time > 2:
-                    self.log.always("T%d heater will shut down in %s seconds." % (self.name, self.log._seconds_to_human_string(self.idle_to_powerdown_time)))
-            self.heater_state = chng_state
-
+                if self.idle_to_powerdown_time > 2 and self.log.info_enabled:
+                    self.log.always("T%d heater will shut down in %s seconds.", self.name, self.log._seconds_to_human_string(self.idle_to_powerdown_time))
+            self.heater_state = int(chng_state)
+
+
+    # Most tools are never heated in a given session, so their timers are created on first access.
+    def _create_timer(self, temp_type):
+        # For all virtual tools that are not also a physical parent, use physical parent's timer.
+        if self.physical_parent_id > self.TOOL_UNLOCKED and self.physical_parent_id != self.name:
+            if temp_type == ToolStandbyTempTimer.TIMER_TO_STANDBY:
+                return self.pp.get_timer_to_standby()
+            return self.pp.get_timer_to_powerdown()
+        # Set up new timers if physical tool.
+        return ToolStandbyTempTimer(self.printer, self.name, temp_type)
+
+    @property
+    def timer_idle_to_standby(self):
+        if self._timer_idle_to_standby is None and self.extruder is not None:
+            self._timer_idle_to_standby = self._create_timer(ToolStandbyTempTimer.TIMER_TO_STANDBY)
+        return self._timer_idle_to_standby
+
+    @property
+    def timer_idle_to_powerdown(self):
+        if self._timer_idle_to_powerdown is None and self.extruder is not None:
+            self._timer_idle_to_powerdown = self._create_timer(ToolStandbyTempTimer.TIMER_TO_SHUTDOWN)
+        return self._timer_idle_to_powerdown
 
     def get_timer_to_standby(self):
         return self.timer_idle_to_standby
@@ -627,6 +705,9 @@ class Tool:
         return self.timer_idle_to_powerdown
 
     def get_status(self, eventtime= None):
+        # Inheritance at startup and every gcode template context read this, so only rebuild it after a change.
+        if self._status_cache is not None:
+            return self._status_cache
         status = {
             "name": self.name,
             "is_virtual": self.is_virtual,
@@ -654,6 +735,7 @@ class Tool:
             "requires_pickup_for_virtual_unload": self.requires_pickup_for_virtual_unload,
             "unload_virtual_at_dropoff": self.unload_virtual_at_dropoff
         }
+        self._status_cache = status
         return status
 
     # Based on DelayedGcode.
@@ -665,41 +747,40 @@ class ToolStandbyTempTimer:
         self.printer = printer
         self.tool_id = tool_id
         self.last_virtual_tool_using_physical_timer = None
+        self._last_tool = None          # Tool object of last_virtual_tool_using_physical_timer, resolved in set_timer.
 
         self.duration = 0.
         self.temp_type = temp_type      # 0= Time to shutdown, 1= Time to standby.
 
         self.reactor = self.printer.get_reactor()
+        # Reactor members used every time the timer is set or reported.
+        self._monotonic = self.reactor.monotonic
+        self._NEVER = self.reactor.NEVER
+        self._update_timer = self.reactor.update_timer
         self.gcode = self.printer.lookup_object('gcode')
-        self.timer_handler = None
         self.inside_timer = self.repeat = False
-        self.printer.register_event_handler("klippy:ready", self._handle_ready)
+        # Registered right away as tools create their timers lazily, possibly after klippy:ready.
+        self.timer_handler = self.reactor.register_timer(
+            self._standby_tool_temp_timer_event, self._NEVER)
         self.toollock = self.printer.lookup_object('toollock')
         self.log = self.printer.lookup_object('ktcclog')
 
         self.counting_down = False
-        self.nextwake = self.reactor.NEVER
-
-
-    def _handle_ready(self):
-        self.timer_handler = self.reactor.register_timer(
-            self._standby_tool_temp_timer_event, self.reactor.NEVER)
+        self.nextwake = self._NEVER
 
     def _standby_tool_temp_timer_event(self, eventtime):
         self.inside_timer = True
         self.counting_down = False
-        try:
-            if self.last_virtual_tool_using_physical_timer is None:
-                raise Exception("last_virtual_tool_using_physical_timer is < None")
-
-            tool = self.printer.lookup_object("tool " + str(self.last_virtual_tool_using_physical_timer))
-            if tool.is_virtual == True:
-                tool_for_tracking_heater = tool.physical_parent_id
-            else:
-                tool_for_tracking_heater = tool.name
-
 
+        tool = self._last_tool
+        if tool is None:
+            # No tool has set this timer yet, so there is no heater to change.
+            self.log.always("_standby_tool_temp_timer_event: Timer for T%s fired before any tool set it.", self.tool_id)
+            self.inside_timer = self.repeat = False
+            self.nextwake = self._NEVER
+            return self._NEVER
 
+        if self.log.trace_enabled:
             self.log.trace(
                 "_standby_tool_temp_timer_event: Running for T%s. temp_type:%s. %s" % 
                 (str(self.tool_id), 
@@ -707,54 +788,59 @@ class ToolStandbyTempTimer:
                  ("For virtual tool T%s" % str(self.last_virtual_tool_using_physical_timer) ) 
                  if  self.last_virtual_tool_using_physical_timer != self.tool_id else ""))
 
-            temperature = 0
-            heater = self.printer.lookup_object(tool.extruder).get_heater()
-            if self.temp_type == self.TIMER_TO_STANDBY:
-                self.log.track_standby_heater_start(self.tool_id)                                                # Set the standby as started in statistics.
-                temperature = tool.get_status()["heater_standby_temp"]
-                heater.set_temp(temperature)
-                # self.log.trace("_standby_tool_temp_timer_event: Running heater.set_temp(%s)" % str(temperature))
-            else:
-                self.log.track_standby_heater_end(self.tool_id)                                                # Set the standby as finishes in statistics.
-
-                tool.get_timer_to_standby().set_timer(0, self.last_virtual_tool_using_physical_timer)        # Stop Standby timer.
-                #tool.get_timer_to_powerdown().set_timer(0, self.last_virtual_tool_using_physical_timer)        # Stop Poweroff timer. (Already off)
-                tool._set_state(Tool.HEATER_STATE_OFF)        # Set off state.
-                heater.set_temp(0)        # Set temperature to 0.
+        heater = tool._heater
+        if self.temp_type == self.TIMER_TO_STANDBY:
+            self.log.track_standby_heater_start(self.tool_id)                                                # Set the standby as started in statistics.
+            self._set_temp(heater, tool.get_status()["heater_standby_temp"])
+        else:
+            self.log.track_standby_heater_end(self.tool_id)                                                # Set the standby as finishes in statistics.
 
+            tool.get_timer_to_standby().set_timer(0, self.last_virtual_tool_using_physical_timer)        # Stop Standby timer.
+            #tool.get_timer_to_powerdown().set_timer(0, self.last_virtual_tool_using_physical_timer)        # Stop Poweroff timer. (Already off)
+            tool._set_state(Tool.HEATER_STATE_OFF)        # Set off state.
+            self._set_temp(heater, 0)        # Set temperature to 0.
 
-                # tool.set_heater(Tool.HEATER_STATE_OFF)
-            self.log.track_active_heater_end(self.tool_id)                                               # Set the active as finishes in statistics.
+            # tool.set_heater(Tool.HEATER_STATE_OFF)
+        self.log.track_active_heater_end(self.tool_id)                                               # Set the active as finishes in statistics.
 
-        except Exception as e:
-            raise Exception("Failed to set Standby temp for tool T%s: %s. %s" % (str(self.tool_id), 
-                                                                                 ("for virtual T%s" % str(self.last_virtual_tool_using_physical_timer)),
-                                                                                 str(e)))  # if actual_tool_calling != self.tool_id else ""
-
-        self.nextwake = self.reactor.NEVER
+        self.nextwake = self._NEVER
         if self.repeat:
             self.nextwake = eventtime + self.duration
             self.counting_down = True
         self.inside_timer = self.repeat = False
         return self.nextwake
 
-    def set_timer(self, duration, actual_tool_calling):
+    # Setting the temperature is what can fail here, e.g. outside the heater's limits.
+    def _set_temp(self, heater, temperature):
+        try:
+            heater.set_temp(temperature)
+        except Exception as e:
+            raise KTCCError("Failed to set Standby temp for tool T%s: for virtual T%s." % (
+                self.tool_id, self.last_virtual_tool_using_physical_timer)) from e
+
+    # Pass force to reprogram the reactor even when the wake time is unchanged.
+    def set_timer(self, duration, actual_tool_calling, force = False):
         actual_tool_calling = actual_tool_calling
-        self.log.trace(str(self.timer_handler) + ".set_timer: T%s %s, temp_type:%s, duration:%s." % (
-            str(self.tool_id), 
-            ("for virtual T%s" % str(actual_tool_calling)) if actual_tool_calling != self.tool_id else "",
-            ("Standby" if self.temp_type == 1 else "OFF"), 
-            str(duration)))
+        if self.log.trace_enabled:
+            self.log.trace(str(self.timer_handler) + ".set_timer: T%s %s, temp_type:%s, duration:%s." % (
+                str(self.tool_id), 
+                ("for virtual T%s" % str(actual_tool_calling)) if actual_tool_calling != self.tool_id else "",
+                ("Standby" if self.temp_type == 1 else "OFF"), 
+                str(duration)))
         self.duration = float(duration)
+        if actual_tool_calling != self.last_virtual_tool_using_physical_timer or self._last_tool is None:
+            self._last_tool = self.printer.lookup_object("tool " + str(actual_tool_calling))
         self.last_virtual_tool_using_physical_timer = actual_tool_calling
         if self.inside_timer:
             self.repeat = (self.duration != 0.)
         else:
-            waketime = self.reactor.NEVER
+            waketime = self._NEVER
             if self.duration:
-                waketime = self.reactor.monotonic() + self.duration
-                self.nextwake = waketime
-            self.reactor.update_timer(self.timer_handler, waketime)
+                waketime = self._monotonic() + self.duration
+            # Cancelling an idle timer, or re-arming it within a millisecond of its current wake time, changes nothing.
+            if force or abs(waketime - self.nextwake) >= 0.001:
+                self._update_timer(self.timer_handler, waketime)
+            self.nextwake = waketime
             self.counting_down = True
 
     def get_status(self, eventtime= None):
@@ -768,11 +854,11 @@ class ToolStandbyTempTimer:
         }
         return status
 
+    # Seconds until the timer fires, infinite when it is not set.
     def _time_left(self):
-        if self.nextwake == self.reactor.NEVER:
-            return "never"
-        else:
-            return str( self.nextwake - self.reactor.monotonic() )
+        if self.nextwake == self._NEVER:
+            return float('inf')
+        return self.nextwake - self._monotonic()
 
 
     # Todo: 
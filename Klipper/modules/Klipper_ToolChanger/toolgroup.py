@@ -16,10 +16,16 @@
 
 
 class ToolGroup:
+    # Options tools look up through get_config() when they don't set them themselves.
+    INHERITED_OPTIONS = ('pickup_gcode', 'dropoff_gcode', 'virtual_toolload_gcode', 'virtual_toolunload_gcode',
+                         'meltzonelength', 'lazy_home_when_parking')
+
     def __init__(self, config):
         self.printer = config.get_printer()
         self.name = config.get_name().split(' ')[1]
         self.config = config
+        # Raw config values looked up through get_config(), preloaded with the ones tools inherit.
+        self._config_memo = dict((option, config.get(option, None)) for option in self.INHERITED_OPTIONS)
         # gcode_macro = self.printer.load_object(config, 'gcode_macro')
 
         try:
@@ -48,12 +54,8 @@ class ToolGroup:
         self.requires_pickup_for_virtual_unload = self.config.getboolean("requires_pickup_for_virtual_unload", True)
         self.unload_virtual_at_dropoff = self.config.getboolean("unload_virtual_at_dropoff", True)
 
-
-    def get_config(self, config_param, default = None):
-        return self.config.get(config_param, default)
-        
-    def get_status(self, eventtime= None):
-        status = {
+        # Nothing in a toolgroup changes after config, so its status is built once.
+        self._status = {
             "is_virtual": self.is_virtual,
             "physical_parent_id": self.physical_parent_id,
             "lazy_home_when_parking": self.lazy_home_when_parking,
@@ -64,7 +66,16 @@ class ToolGroup:
             "requires_pickup_for_virtual_unload": self.requires_pickup_for_virtual_unload,
             "unload_virtual_at_dropoff": self.unload_virtual_at_dropoff
         }
-        return status
+
+    # Every tool of the group falls back on these, so each parameter is only read from the config once.
+    def get_config(self, config_param, default = None):
+        if config_param not in self._config_memo:
+            self._config_memo[config_param] = self.config.get(config_param, None)
+        value = self._config_memo[config_param]
+        return default if value is None else value
+        
+    def get_status(self, eventtime= None):
+        return self._status
 
 def load_config_prefix(config):
     return ToolGroup(config)
@@ -14,11 +14,25 @@
 # ToolLock: Toollock is engaged.
 # ToolUnLock: Toollock is disengaged.
 
+import math
+
 class ToolLock:
     TOOL_UNKNOWN = -2
     TOOL_UNLOCKED = -1
     BOOT_DELAY = 1.5            # Delay before running bootup tasks
+    SAVE_DELAY = 0.1            # Delay before writing changed variables to disk, so rapid changes share one write
+    ENDSTOP_FIRST_DWELL = 0.005 # Delay before the second endstop check, doubled for each check after up to the max dwell
+    ENDSTOP_ATEMPT_DWELL = 0.1  # Time each of the ATEMPTS of a limited endstop query stands for
     VARS_KTCC_TOOL_MAP = "ktcc_state_tool_remap"
+    # G-Code commands registered by the toollock, as (command, handler attribute, help attribute).
+    COMMANDS = tuple((cmd, 'cmd_' + cmd, 'cmd_' + cmd + '_help') for cmd in (
+        'SAVE_CURRENT_TOOL', 'TOOL_LOCK', 'TOOL_UNLOCK',
+        'KTCC_TOOL_DROPOFF_ALL', 'SET_AND_SAVE_FAN_SPEED', 'TEMPERATURE_WAIT_WITH_TOLERANCE',
+        'SET_TOOL_TEMPERATURE', 'SET_GLOBAL_OFFSET', 'SET_TOOL_OFFSET',
+        'SET_PURGE_ON_TOOLCHANGE', 'SAVE_POSITION', 'SAVE_CURRENT_POSITION',
+        'RESTORE_POSITION', 'KTCC_SET_GCODE_OFFSET_FOR_CURRENT_TOOL',
+        'KTCC_DISPLAY_TOOL_MAP', 'KTCC_REMAP_TOOL', 'KTCC_ENDSTOP_QUERY',
+        'KTCC_SET_ALL_TOOL_HEATERS_OFF', 'KTCC_RESUME_ALL_TOOL_HEATERS'))
 
     def __init__(self, config):
         self.printer = config.get_printer()
@@ -29,6 +43,7 @@ class ToolLock:
         self.global_offset = [0, 0, 0]    # Global offset to apply to all tools
         self.saved_fan_speed = 0          # Saved partcooling fan speed when deselecting a tool with a fan.
         self.tool_current = "-2"          # -2 Unknown tool locked, -1 No tool locked, 0 and up are tools.
+        self._tool_current_i = -2         # tool_current as int, kept in step with it.
         self.init_printer_to_last_tool = config.getboolean(
             'init_printer_to_last_tool', True)
         self.purge_on_toolchange = config.getboolean(
@@ -40,63 +55,74 @@ class ToolLock:
         self.tool_map = {}
         self.last_endstop_query = {}
         self.changes_made_by_set_all_tool_heaters_off={}
+        self._heaters_off_by_state = {1: [], 2: []}    # Tools turned off by set_all_tool_heaters_off, by the heater_state to resume.
+        self._status_cache = None         # Cached get_status() dict, cleared whenever a status field is reassigned.
+        self._tool_obj_cache = {}         # Tool objects by tool number as string, see _get_tool().
+        self._all_tools = None            # (name, tool) pairs of all tools, see _get_all_tools().
+        self._extruder_by_tool = {}       # Extruder name, or None, by tool number as string, see _get_tool_extruder().
+        self._save_variables = None       # Set at klippy:ready.
+        self._gcode_move = None           # Set at klippy:ready.
+        self._pending_saves = {}          # Variables waiting for _flush_saves(), by name.
+        self._save_scheduled = False
+        self._save_params = {}            # Parameters of _save_gcmd, filled in for each variable written.
+        self._save_gcmd = None            # SAVE_VARIABLE command reused by _flush_saves(), set at klippy:ready.
 
         # G-Code macros
         self.tool_lock_gcode_template = gcode_macro.load_template(config, 'tool_lock_gcode', '')
         self.tool_unlock_gcode_template = gcode_macro.load_template(config, 'tool_unlock_gcode', '')
 
         # Register commands
-        handlers = [
-            'SAVE_CURRENT_TOOL', 'TOOL_LOCK', 'TOOL_UNLOCK',
-            'KTCC_TOOL_DROPOFF_ALL', 'SET_AND_SAVE_FAN_SPEED', 'TEMPERATURE_WAIT_WITH_TOLERANCE', 
-            'SET_TOOL_TEMPERATURE', 'SET_GLOBAL_OFFSET', 'SET_TOOL_OFFSET',
-            'SET_PURGE_ON_TOOLCHANGE', 'SAVE_POSITION', 'SAVE_CURRENT_POSITION', 
-            'RESTORE_POSITION', 'KTCC_SET_GCODE_OFFSET_FOR_CURRENT_TOOL',
-            'KTCC_DISPLAY_TOOL_MAP', 'KTCC_REMAP_TOOL', 'KTCC_ENDSTOP_QUERY',
-            'KTCC_SET_ALL_TOOL_HEATERS_OFF', 'KTCC_RESUME_ALL_TOOL_HEATERS']
-        for cmd in handlers:
-            func = getattr(self, 'cmd_' + cmd)
-            desc = getattr(self, 'cmd_' + cmd + '_help', None)
-            self.gcode.register_command(cmd, func, False, desc)
+        for cmd, func_name, desc_name in self.COMMANDS:
+            self.gcode.register_command(cmd, getattr(self, func_name), False, getattr(self, desc_name, None))
 
         self.printer.register_event_handler("klippy:ready", self.handle_ready)
+        self.printer.register_event_handler("klippy:disconnect", self._handle_disconnect)
 
     def handle_ready(self):
         # Load persistent Tool remaping.
-        self.tool_map = self.printer.lookup_object('save_variables').allVariables.get(self.VARS_KTCC_TOOL_MAP, {})
+        self._save_variables = self.printer.lookup_object('save_variables')
+        self._gcode_move = self.printer.lookup_object('gcode_move')
+        self._save_gcmd = self.gcode.create_gcode_command("SAVE_VARIABLE", "SAVE_VARIABLE", self._save_params)
+        self.tool_map = self._save_variables.allVariables.get(self.VARS_KTCC_TOOL_MAP, {})
         waketime = self.reactor.monotonic() + self.BOOT_DELAY
         self.reactor.register_callback(self._bootup_tasks, waketime)
 
     def _bootup_tasks(self, eventtime):
         try:
+            for tool_name, tool in self._get_all_tools():
+                tool_id = tool_name.split(' ', 1)[1]
+                self._tool_obj_cache[tool_id] = tool
+                self._extruder_by_tool[tool_id] = tool.extruder
             if len(self.tool_map) > 0:
                 self.log.always(self._tool_map_to_human_string())
             self.Initialize_Tool_Lock()
         except Exception as e:
             self.log.always('Warning: Error booting up KTCC: %s' % str(e))
 
-        def Initialize_Tool_Lock(self):
-            if not self.init_printer_to_last_tool:
-                return None
-    
-            # self.log.always("Initialize_Tool_Lock running.")
-            save_variables = self.printer.lookup_object('save_variables')
-            try:
-                self.tool_current = save_variables.allVariables["tool_current"]
-            except:
-                self.tool_current = "-1"
-                save_variables.cmd_SAVE_VARIABLE(self.gcode.create_gcode_command(
-                    "SAVE_VARIABLE", "SAVE_VARIABLE", {"VARIABLE": "tool_current", 'VALUE': self.tool_current }))
-    
-            if str(self.tool_current) == "-1":
-                self.cmd_TOOL_UNLOCK()
-                self.log.always("ToolLock initialized unlocked")
-    
-            else:
-                t = self.tool_current
-                self.ToolLock(True)
-                self.SaveCurrentTool(str(t))
-                self.log.always("ToolLock initialized with T%s." % self.tool_current) 
+    def Initialize_Tool_Lock(self):
+        if not self.init_printer_to_last_tool:
+            return None
+
+        # self.log.always("Initialize_Tool_Lock running.")
+        save_variables = self._save_variables
+        try:
+            self.tool_current = save_variables.allVariables["tool_current"]
+        except:
+            self.tool_current = "-1"
+            save_variables.cmd_SAVE_VARIABLE(self.gcode.create_gcode_command(
+                "SAVE_VARIABLE", "SAVE_VARIABLE", {"VARIABLE": "tool_current", 'VALUE': self.tool_current }))
+        self._tool_current_i = int(self.tool_current)
+        self._status_cache = None
+
+        if str(self.tool_current) == "-1":
+            self.ToolUnlock(True)
+            self.log.always("ToolLock initialized unlocked")
+
+        else:
+            t = self.tool_current
+            self.ToolLock(True)
+            self.SaveCurrentTool(str(t))
+            self.log.always("ToolLock initialized with T%s." % self.tool_current) 
 
     cmd_TOOL_LOCK_help = "Lock the ToolLock."
     def cmd_TOOL_LOCK(self, gcmd = None):
@@ -104,7 +130,7 @@ class ToolLock:
 
     def ToolLock(self, ignore_locked = False):
         self.log.trace("TOOL_LOCK running. ")
-        if not ignore_locked and int(self.tool_current) != -1:
+        if not ignore_locked and self._tool_current_i != self.TOOL_UNLOCKED:
             self.log.always("TOOL_LOCK is already locked with tool " + self.tool_current + ".")
         else:
             self.tool_lock_gcode_template.run_gcode_from_command()
@@ -119,31 +145,34 @@ class ToolLock:
         if self.tool_current == "-2":
             raise self.printer.command_error("cmd_KTCC_TOOL_DROPOFF_ALL: Unknown tool already mounted Can't park unknown tool.")
         if self.tool_current != "-1":
-            self.printer.lookup_object('tool ' + str(self.tool_current)).Dropoff( force_virtual_unload = True )
+            self._get_tool(self.tool_current).Dropoff( force_virtual_unload = True )
         
 
         try:
-            # Need to check all tools at least once but reload them after each time.
-            all_checked_once = False
-            while not all_checked_once:
-                all_tools = dict(self.printer.lookup_objects('tool'))
-                all_checked_once =True # If no breaks in next For loop then we can exit the While loop.
-                for tool_name, tool in all_tools.items():
-                    # If there is a virtual tool loaded:
-                    if tool.get_status()["virtual_loaded"] > self.TOOL_UNLOCKED:
-                        # Pickup and then unload and drop the tool.
-                        self.log.trace("cmd_KTCC_TOOL_DROPOFF_ALL: Picking up and dropping forced: %s." % str(tool.get_status()["virtual_loaded"]))
-                        self.printer.lookup_object("tool " + str(tool.get_status()["virtual_loaded"])).select_tool_actual()
-                        self.printer.lookup_object("tool " + str(tool.get_status()["virtual_loaded"])).Dropoff( force_virtual_unload = True )
-                        all_checked_once =False # Do not exit while loop.
-                        break # Break for loop to start again.
+            # Unloading a virtual tool only clears its own physical parent, so one pass over all tools is enough.
+            for tool_name, tool in self._get_all_tools():
+                # If there is a virtual tool loaded:
+                virtual_loaded = tool.get_status()["virtual_loaded"]
+                if virtual_loaded > self.TOOL_UNLOCKED:
+                    # Pickup and then unload and drop the tool.
+                    self.log.trace("cmd_KTCC_TOOL_DROPOFF_ALL: Picking up and dropping forced: %s.", virtual_loaded)
+                    loaded_tool = self._get_tool(virtual_loaded)
+                    loaded_tool.select_tool_actual()
+                    loaded_tool.Dropoff( force_virtual_unload = True )
 
         except Exception as e:
             raise Exception('cmd_KTCC_TOOL_DROPOFF_ALL: Error: %s' % str(e))
 
     cmd_TOOL_UNLOCK_help = "Unlock the ToolLock."
     def cmd_TOOL_UNLOCK(self, gcmd = None):
+        self.ToolUnlock()
+
+    def ToolUnlock(self, ignore_unlocked = False):
         self.log.trace("TOOL_UNLOCK running. ")
+        # Already unlocked, no need to run the unlock macro and save again.
+        if not ignore_unlocked and self._tool_current_i == self.TOOL_UNLOCKED:
+            self.log.trace("TOOL_UNLOCK: Already unlocked.")
+            return
         self.tool_unlock_gcode_template.run_gcode_from_command()
         self.SaveCurrentTool(-1)
         self.log.trace("ToolLock Unlocked.")
@@ -151,28 +180,49 @@ class ToolLock:
 
 
     def PrinterIsHomedForToolchange(self, lazy_home_when_parking =0):
-        curtime = self.printer.get_reactor().monotonic()
+        curtime = self.reactor.monotonic()
         toolhead = self.printer.lookup_object('toolhead')
         homed = toolhead.get_status(curtime)['homed_axes'].lower()
-        if all(axis in homed for axis in ['x','y','z']):
+        # Axes not homed yet, in the order they are homed.
+        axes_to_home = [axis for axis in 'yxz' if axis not in homed]
+        if not axes_to_home:
             return True
-        elif lazy_home_when_parking == 0 and not all(axis in homed for axis in ['x','y','z']):
+        elif lazy_home_when_parking == 0:
             return False
-        elif lazy_home_when_parking == 1 and 'z' not in homed:
+        elif lazy_home_when_parking == 1 and 'z' in axes_to_home:
             return False
 
-        axes_to_home = ""
-        for axis in ['y','x','z']:
-            if axis not in homed: 
-                axes_to_home += axis
-        self.gcode.run_script_from_command("G28 " + axes_to_home.upper())
+        self.gcode.run_script_from_command("G28 " + ''.join(axes_to_home).upper())
         return True
 
     def SaveCurrentTool(self, t):
         self.tool_current = str(t)
-        save_variables = self.printer.lookup_object('save_variables')
-        save_variables.cmd_SAVE_VARIABLE(self.gcode.create_gcode_command(
-            "SAVE_VARIABLE", "SAVE_VARIABLE", {"VARIABLE": "tool_current", 'VALUE': t}))
+        self._tool_current_i = int(t)
+        self._status_cache = None
+        self._schedule_save("tool_current", t)
+
+    # Queues a SAVE_VARIABLE. Only the last value of each variable is written when the queue is flushed.
+    def _schedule_save(self, variable, value):
+        self._pending_saves[variable] = str(value)
+        if not self._save_scheduled:
+            self._save_scheduled = True
+            self.reactor.register_callback(self._flush_saves, self.reactor.monotonic() + self.SAVE_DELAY)
+
+    def _flush_saves(self, eventtime = None):
+        self._save_scheduled = False
+        pending, self._pending_saves = self._pending_saves, {}
+        for variable, value in pending.items():
+            self._save_params["VARIABLE"] = variable
+            self._save_params["VALUE"] = value
+            try:
+                self._save_variables.cmd_SAVE_VARIABLE(self._save_gcmd)
+            except Exception as e:
+                self.log.always("Warning: Could not save %s: %s" % (variable, str(e)))
+
+    def _handle_disconnect(self):
+        # Don't lose changes still waiting for the delayed write.
+        if self._pending_saves:
+            self._flush_saves()
 
     cmd_SAVE_CURRENT_TOOL_help = "Save the current tool to file to load at printer startup."
     def cmd_SAVE_CURRENT_TOOL(self, gcmd):
@@ -183,7 +233,7 @@ class ToolLock:
     cmd_SET_AND_SAVE_FAN_SPEED_help = "Save the fan speed to be recovered at ToolChange."
     def cmd_SET_AND_SAVE_FAN_SPEED(self, gcmd):
         fanspeed = gcmd.get_float('S', 1, minval=0, maxval=255)
-        tool_id = gcmd.get_int('P', int(self.tool_current), minval=0)
+        tool_id = gcmd.get_int('P', self._tool_current_i, minval=0)
 
         # The minval above doesn't seem to work.
         if tool_id < 0:
@@ -210,10 +260,10 @@ class ToolLock:
             tool_id = tool_is_remaped
 
 
-        tool = self.printer.lookup_object("tool " + str(tool_id))
+        tool = self._get_tool(tool_id)
 
         if tool.fan is None:
-            self.log.debug("ToolLock.SetAndSaveFanSpeed: Tool %s has no fan." % str(tool_id))
+            self.log.debug("ToolLock.SetAndSaveFanSpeed: Tool %s has no fan.", tool_id)
         else:
             self.SaveFanSpeed(fanspeed)
             self.gcode.run_script_from_command(
@@ -231,7 +281,7 @@ class ToolLock:
 #  HEATER=nnn Heater number. 0="heater_bed", 1="extruder", 2="extruder1", etc.
 #  TOLERANCE=nnn Tolerance in degC. Defaults to 1*C. Wait will wait until heater is between set temperature +/- tolerance.
     def cmd_TEMPERATURE_WAIT_WITH_TOLERANCE(self, gcmd):
-        curtime = self.printer.get_reactor().monotonic()
+        curtime = self.reactor.monotonic()
         heater_name = None
         tool_id = gcmd.get_int('TOOL', None, minval=0)
         heater_id = gcmd.get_int('HEATER', None, minval=0)
@@ -242,8 +292,8 @@ class ToolLock:
             return None
         elif tool_id is None and heater_id is None:
             tool_id = self.tool_current
-            if int(self.tool_current) >= 0:
-                heater_name = self.printer.lookup_object("tool " + self.tool_current).get_status()["extruder"]
+            if self._tool_current_i >= 0:
+                heater_name = self._get_tool_extruder(self.tool_current)
             #wait for bed
             self._Temperature_wait_with_tolerance(curtime, "heater_bed", tolerance)
 
@@ -254,8 +304,7 @@ class ToolLock:
                 if tool_is_remaped > -1:
                     tool_id = tool_is_remaped
 
-                heater_name = self.printer.lookup_object(   # Set the heater_name to the extruder of the tool.
-                    "tool " + str(tool_id)).get_status(curtime)["extruder"]
+                heater_name = self._get_tool_extruder(tool_id)    # Set the heater_name to the extruder of the tool.
             elif heater_id == 0:                            # Else If 0, then heater_bed.
                 heater_name = "heater_bed"                      # Set heater_name to "heater_bed".
 
@@ -274,23 +323,21 @@ class ToolLock:
         
         if target_temp > 40:                                # Only wait if set temperature is over 40*C
             self.log.always("Wait for heater " + heater_name + " to reach " + str(target_temp) + " with a tolerance of " + str(tolerance) + ".")
-            self.gcode.run_script_from_command(
-                "TEMPERATURE_WAIT SENSOR=" + heater_name + 
-                " MINIMUM=" + str(target_temp - tolerance) + 
-                " MAXIMUM=" + str(target_temp + tolerance) )
+            self.gcode.run_script_from_command("TEMPERATURE_WAIT SENSOR=%s MINIMUM=%d MAXIMUM=%d" % (
+                heater_name, target_temp - tolerance, target_temp + tolerance))
             self.log.always("Wait for heater " + heater_name + " complete.")
 
     def _get_tool_id_from_gcmd(self, gcmd):
         tool_id = gcmd.get_int('TOOL', None, minval=0)
 
         if tool_id is None:
-            tool_id = self.tool_current
-        if not int(tool_id) > self.TOOL_UNLOCKED:
+            tool_id = self._tool_current_i
+        if not tool_id > self.TOOL_UNLOCKED:
             self.log.always("_get_tool_id_from_gcmd: Tool " + str(tool_id) + " is not valid.")
             return None
         else:
             # Check if the requested tool has been remaped to another one.
-            tool_is_remaped = self.tool_is_remaped(int(tool_id))
+            tool_is_remaped = self.tool_is_remaped(tool_id)
             if tool_is_remaped > self.TOOL_UNLOCKED:
                 tool_id = tool_is_remaped
         return tool_id
@@ -317,11 +364,11 @@ class ToolLock:
         shtdwn_timeout = gcmd.get_float('SHTDWN_TIMEOUT', None, minval=0)
 
 
-        if self.printer.lookup_object("tool " + str(tool_id)).get_status()["extruder"] is None:
-            self.log.trace("cmd_SET_TOOL_TEMPERATURE: T%s has no extruder! Nothing to do." % str(tool_id))
+        if self._get_tool_extruder(tool_id) is None:
+            self.log.trace("cmd_SET_TOOL_TEMPERATURE: T%s has no extruder! Nothing to do.", tool_id)
             return None
 
-        tool = self.printer.lookup_object("tool " + str(tool_id))
+        tool = self._get_tool(tool_id)
         set_heater_cmd = {}
 
         if stdb_tmp is not None:
@@ -345,8 +392,10 @@ class ToolLock:
             if tool.heater_state != 3:
                 if tool.timer_idle_to_standby.get_status()["next_wake"] == True:
                     msg += "\n Will go to standby temperature in in %s seconds." % tool.timer_idle_to_standby.get_status()["next_wake"]
-                if tool.timer_idle_to_powerdown.get_status()["counting_down"] == True:
-                    msg += "\n Will power down in %s seconds." % tool.timer_idle_to_powerdown.get_status()["next_wake"]
+                powerdown_status = tool.timer_idle_to_powerdown.get_status()
+                # next_wake is infinite when the timer has no deadline, even if counting_down is set.
+                if powerdown_status["counting_down"] == True and not math.isinf(powerdown_status["next_wake"]):
+                    msg += "\n Will power down in %s seconds." % powerdown_status["next_wake"]
             gcmd.respond_info(msg)
 
     cmd_KTCC_SET_ALL_TOOL_HEATERS_OFF_help = "Turns off all heaters and saves changes made to be resumed by KTCC_RESUME_ALL_TOOL_HEATERS."
@@ -354,19 +403,22 @@ class ToolLock:
         self.set_all_tool_heaters_off()
 
     def set_all_tool_heaters_off(self):
-        all_tools = dict(self.printer.lookup_objects('tool'))
         self.changes_made_by_set_all_tool_heaters_off = {}
+        self._heaters_off_by_state = {1: [], 2: []}
 
         try:
-            for tool_name, tool in all_tools.items():
-                if tool.get_status()["extruder"] is None:
+            for tool_name, tool in self._get_all_tools():
+                status = tool.get_status()
+                if status["extruder"] is None:
                     # self.log.trace("set_all_tool_heaters_off: T%s has no extruder! Nothing to do." % str(tool_name))
                     continue
-                if tool.get_status()["heater_state"] == 0:
+                heater_state = status["heater_state"]
+                if heater_state == 0:
                     # self.log.trace("set_all_tool_heaters_off: T%s already off! Nothing to do." % str(tool_name))
                     continue
-                self.log.trace("set_all_tool_heaters_off: T%s saved with heater_state: %str." % ( str(tool_name), str(tool.get_status()["heater_state"])))
-                self.changes_made_by_set_all_tool_heaters_off[tool_name] = tool.get_status()["heater_state"]
+                self.log.trace("set_all_tool_heaters_off: T%s saved with heater_state: %str.", tool_name, heater_state)
+                self.changes_made_by_set_all_tool_heaters_off[tool_name] = heater_state
+                self._heaters_off_by_state[heater_state].append(tool)
                 tool.set_heater(heater_state = 0)
         except Exception as e:
             raise Exception('set_all_tool_heaters_off: Error: %s' % str(e))
@@ -376,16 +428,13 @@ class ToolLock:
         self.resume_all_tool_heaters()
 
     def resume_all_tool_heaters(self):
+        if not self.changes_made_by_set_all_tool_heaters_off:
+            return
         try:
-            # Loop it 2 times, first for all heaters standby and then the active.
-
-            for tool_name, v in self.changes_made_by_set_all_tool_heaters_off.items():
-                if v == 1:
-                    self.printer.lookup_object(str(tool_name)).set_heater(heater_state = v)
-
-            for tool_name, v in self.changes_made_by_set_all_tool_heaters_off.items():
-                if v == 2:
-                    self.printer.lookup_object(str(tool_name)).set_heater(heater_state = v)
+            # First all heaters to standby and then the active.
+            for heater_state in (1, 2):
+                for tool in self._heaters_off_by_state[heater_state]:
+                    tool.set_heater(heater_state = heater_state)
 
         except Exception as e:
             raise Exception('set_all_tool_heaters_off: Error: %s' % str(e))
@@ -396,54 +445,31 @@ class ToolLock:
         tool_id = self._get_tool_id_from_gcmd(gcmd)
         if tool_id is None: return
 
-        x_pos = gcmd.get_float('X', None)
-        x_adjust = gcmd.get_float('X_ADJUST', None)
-        y_pos = gcmd.get_float('Y', None)
-        y_adjust = gcmd.get_float('Y_ADJUST', None)
-        z_pos = gcmd.get_float('Z', None)
-        z_adjust = gcmd.get_float('Z_ADJUST', None)
-
-        tool = self.printer.lookup_object("tool " + str(tool_id))
+        tool = self._get_tool(tool_id)
         set_offset_cmd = {}
 
-        if x_pos is not None:
-            set_offset_cmd["x_pos"] = x_pos
-        elif x_adjust is not None:
-            set_offset_cmd["x_adjust"] = x_adjust
-        if y_pos is not None:
-            set_offset_cmd["y_pos"] = y_pos
-        elif y_adjust is not None:
-            set_offset_cmd["y_adjust"] = y_adjust
-        if z_pos is not None:
-            set_offset_cmd["z_pos"] = z_pos
-        elif z_adjust is not None:
-            set_offset_cmd["z_adjust"] = z_adjust
+        for axis in INDEX_TO_XYZ:
+            pos = gcmd.get_float(axis, None)
+            adjust = gcmd.get_float(axis + '_ADJUST', None)
+            if pos is not None:
+                set_offset_cmd[axis.lower() + "_pos"] = pos
+            elif adjust is not None:
+                set_offset_cmd[axis.lower() + "_adjust"] = adjust
         if len(set_offset_cmd) > 0:
             tool.set_offset(**set_offset_cmd)
 
     cmd_SET_GLOBAL_OFFSET_help = "Set the global tool offset"
     def cmd_SET_GLOBAL_OFFSET(self, gcmd):
-        x_pos = gcmd.get_float('X', None)
-        x_adjust = gcmd.get_float('X_ADJUST', None)
-        y_pos = gcmd.get_float('Y', None)
-        y_adjust = gcmd.get_float('Y_ADJUST', None)
-        z_pos = gcmd.get_float('Z', None)
-        z_adjust = gcmd.get_float('Z_ADJUST', None)
-
-        if x_pos is not None:
-            self.global_offset[0] = float(x_pos)
-        elif x_adjust is not None:
-            self.global_offset[0] = float(self.global_offset[0]) + float(x_adjust)
-        if y_pos is not None:
-            self.global_offset[1] = float(y_pos)
-        elif y_adjust is not None:
-            self.global_offset[1] = float(self.global_offset[1]) + float(y_adjust)
-        if z_pos is not None:
-            self.global_offset[2] = float(z_pos)
-        elif z_adjust is not None:
-            self.global_offset[2] = float(self.global_offset[2]) + float(z_adjust)
-
-        self.log.trace("Global offset now set to: %f, %f, %f." % (float(self.global_offset[0]), float(self.global_offset[1]), float(self.global_offset[2])))
+        for i, axis in enumerate(INDEX_TO_XYZ):
+            pos = gcmd.get_float(axis, None)
+            adjust = gcmd.get_float(axis + '_ADJUST', None)
+            if pos is not None:
+                self.global_offset[i] = pos
+            elif adjust is not None:
+                self.global_offset[i] = float(self.global_offset[i]) + adjust
+        self._status_cache = None
+
+        self.log.trace("Global offset now set to: %f, %f, %f.", self.global_offset[0], self.global_offset[1], self.global_offset[2])
 
     cmd_SET_PURGE_ON_TOOLCHANGE_help = "Set the global variable if the tool should be purged or primed with filament at toolchange."
     def cmd_SET_PURGE_ON_TOOLCHANGE(self, gcmd = None):
@@ -453,9 +479,11 @@ class ToolLock:
             self.purge_on_toolchange = False
         else:
             self.purge_on_toolchange = True
+        self._status_cache = None
 
     def SaveFanSpeed(self, fanspeed):
         self.saved_fan_speed = float(fanspeed)
+        self._status_cache = None
        
     cmd_SAVE_POSITION_help = "Save the specified G-Code position."
 #  Sets the Restore type and saves specified position.
@@ -477,6 +505,7 @@ class ToolLock:
         if param_Z is not None:
             restore_axis += 'Z'
         self.restore_axis_on_toolchange = restore_axis
+        self._status_cache = None
 
     cmd_SAVE_CURRENT_POSITION_help = "Save the current G-Code position."
 #  Saves current position. 
@@ -494,8 +523,8 @@ class ToolLock:
     def SaveCurrentPosition(self, restore_axis = None):
         if restore_axis is not None:
             self.restore_axis_on_toolchange = restore_axis
-        gcode_move = self.printer.lookup_object('gcode_move')
-        self.saved_position = gcode_move._get_gcode_position()
+        self.saved_position = self._gcode_move._get_gcode_position()
+        self._status_cache = None
 
     cmd_RESTORE_POSITION_help = "Restore a previously saved G-Code position if it was specified in the toolchange T# command."
 #  Restores the previously saved possition according to
@@ -507,7 +536,8 @@ class ToolLock:
 #    XYZ: Restore specified axis
     def cmd_RESTORE_POSITION(self, gcmd):
         self.restore_axis_on_toolchange = parse_restore_type(gcmd, 'RESTORE_POSITION_TYPE', default=self.restore_axis_on_toolchange)
-        self.log.trace("cmd_RESTORE_POSITION running: " + str(self.restore_axis_on_toolchange))
+        self._status_cache = None
+        self.log.trace("cmd_RESTORE_POSITION running: %s", self.restore_axis_on_toolchange)
         speed = gcmd.get_int('F', None)
 
         if not self.restore_axis_on_toolchange:
@@ -517,11 +547,11 @@ class ToolLock:
 
         try:
             p = self.saved_position
-            cmd = 'G1'
-            for t in self.restore_axis_on_toolchange:
-                cmd += ' %s%.3f' % (t, p[XYZ_TO_INDEX[t]])
+            parts = ['G1']
+            parts.extend(['%s%.3f' % (t, p[XYZ_TO_INDEX[t]]) for t in self.restore_axis_on_toolchange])
             if speed:
-                cmd += " F%i" % (speed,)
+                parts.append("F%i" % (speed,))
+            cmd = ' '.join(parts)
             # Restore position
             self.log.trace("cmd_RESTORE_POSITION running: " + cmd)
             self.gcode.run_script_from_command(cmd)
@@ -529,6 +559,9 @@ class ToolLock:
             raise gcmd.error("Could not restore position.")
 
     def get_status(self, eventtime= None):
+        # Tool changes ask for this several times per T command, so only rebuild it after a change.
+        if self._status_cache is not None:
+            return self._status_cache
         status = {
             "global_offset": self.global_offset,
             "tool_current": self.tool_current,
@@ -538,6 +571,7 @@ class ToolLock:
             "saved_position": self.saved_position,
             "last_endstop_query": self.last_endstop_query
         }
+        self._status_cache = status
         return status
 
     cmd_KTCC_SET_GCODE_OFFSET_FOR_CURRENT_TOOL_help = "Set G-Code offset to the one of current tool."
@@ -547,9 +581,9 @@ class ToolLock:
 #    0: No move
 #    1: Move
     def cmd_KTCC_SET_GCODE_OFFSET_FOR_CURRENT_TOOL(self, gcmd):
-        current_tool_id = int(self.get_status()['tool_current']) # int(self.toollock.get_tool_current())
+        current_tool_id = self._tool_current_i
 
-        self.log.trace("Setting offsets to those of T" + str(current_tool_id) + ".")
+        self.log.trace("Setting offsets to those of T%d.", current_tool_id)
 
         if current_tool_id <= self.TOOL_UNLOCKED:
             msg = "KTCC_SET_GCODE_OFFSET_FOR_CURRENT_TOOL: Unknown tool mounted. Can't set offsets."
@@ -558,39 +592,59 @@ class ToolLock:
         else:
             # If optional MOVE parameter is passed as 0 or 1
             param_Move = gcmd.get_int('MOVE', 0, minval=0, maxval=1)
-            current_tool = self.printer.lookup_object('tool ' + str(current_tool_id))
-            self.log.trace("SET_GCODE_OFFSET X=%s Y=%s Z=%s MOVE=%s" % (str(current_tool.offset[0]), str(current_tool.offset[1]), str(current_tool.offset[2]), str(param_Move)))
-            self.gcode.run_script_from_command("SET_GCODE_OFFSET X=%s Y=%s Z=%s MOVE=%s" % (str(current_tool.offset[0]), str(current_tool.offset[1]), str(current_tool.offset[2]), str(param_Move)))
+            current_tool = self._get_tool(current_tool_id)
+            offset = current_tool.offset
+            cmd = "SET_GCODE_OFFSET X=%s Y=%s Z=%s MOVE=%d" % (offset[0], offset[1], offset[2], param_Move)
+            self.log.trace(cmd)
+            self.gcode.run_script_from_command(cmd)
 
 
+    # Tools don't change after config is loaded, so each one is only looked up in the printer once.
+    def _get_tool(self, tool_id):
+        key = str(tool_id)
+        tool = self._tool_obj_cache.get(key)
+        if tool is None:
+            tool = self.printer.lookup_object("tool " + key)
+            self._tool_obj_cache[key] = tool
+        return tool
+
+    # The set of tools is fixed once the config is loaded.
+    def _get_all_tools(self):
+        if self._all_tools is None:
+            self._all_tools = self.printer.lookup_objects('tool')
+        return self._all_tools
+
+    # A tool's extruder is fixed in its config section.
+    def _get_tool_extruder(self, tool_id):
+        key = str(tool_id)
+        if key not in self._extruder_by_tool:
+            self._extruder_by_tool[key] = self._get_tool(key).extruder
+        return self._extruder_by_tool[key]
+
 ###########################################
 # TOOL REMAPING                           #
 ###########################################
 
     def _set_tool_to_tool(self, from_tool, to_tool):
         #Check first if to_tool is a valid tool.
-        tools = self.printer.lookup_objects('tool')
-        if not [item for item in tools if item[0] == ("tool " + str(to_tool))]:
+        if self.printer.lookup_object("tool " + str(to_tool), None) is None:
             self.log.always("Tool %s not a valid tool" % str(to_tool))
             return False
 
         # Set the new tool.
         self.tool_map[from_tool] = to_tool
-        self.gcode.run_script_from_command("SAVE_VARIABLE VARIABLE=%s VALUE='%s'" % (self.VARS_KTCC_TOOL_MAP, self.tool_map))
+        self._schedule_save(self.VARS_KTCC_TOOL_MAP, self.tool_map)
 
     def _tool_map_to_human_string(self):
-        msg = "Number of tools remaped: " + str(len(self.tool_map))
-
-        for from_tool, to_tool in self.tool_map.items():
-            msg += "\nTool %s-> Tool %s" % ( str(from_tool), str(to_tool))
-
-        return msg
+        lines = ["Number of tools remaped: %d" % len(self.tool_map)]
+        lines.extend(["Tool %s-> Tool %s" % (from_tool, to_tool) for from_tool, to_tool in self.tool_map.items()])
+        return "\n".join(lines)
 
     def tool_is_remaped(self, tool_to_check):
-        if tool_to_check in self.tool_map:
-            return self.tool_map[tool_to_check]
-        else:
+        # Most printers have no remaps at all.
+        if not self.tool_map:
             return -1
+        return self.tool_map.get(tool_to_check, -1)
 
     def _remap_tool(self, tool, gate, available):
         self._set_tool_to_tool(tool, gate)
@@ -599,7 +653,7 @@ class ToolLock:
     def _reset_tool_mapping(self):
         self.log.debug("Resetting Tool map")
         self.tool_map = {}
-        self.gcode.run_script_from_command("SAVE_VARIABLE VARIABLE=%s VALUE='%s'" % (self.VARS_KTCC_TOOL_MAP, self.tool_map))
+        self._schedule_save(self.VARS_KTCC_TOOL_MAP, self.tool_map)
 
 ### GCODE COMMANDS FOR TOOL REMAP LOGIC ##################################
 
@@ -623,7 +677,8 @@ class ToolLock:
                 self._remap_tool(from_tool, to_tool, available)
             # else:
             #     self._set_tool_status(to_tool, available)
-        self.log.info(self._tool_map_to_human_string())
+        if self.log.info_enabled:
+            self.log.info(self._tool_map_to_human_string())
 
 ### GCODE COMMANDS FOR witing on endstop (Jubilee sytle toollock) ##################################
 
@@ -648,22 +703,30 @@ class ToolLock:
         toolhead = self.printer.lookup_object("toolhead")
         eventtime = self.reactor.monotonic()
 
-        dwell = 0.1
+        max_dwell = self.ENDSTOP_ATEMPT_DWELL
         if atempts == -1:
-            dwell = 1.0
+            max_dwell = 1.0
+        # ATEMPTS checks used to be a fixed dwell apart, keep waiting as long as they took.
+        deadline = eventtime + (atempts - 1) * self.ENDSTOP_ATEMPT_DWELL
+        # Start polling fast so a quick transition isn't held up by a full dwell, then back off.
+        dwell = self.ENDSTOP_FIRST_DWELL
 
         i=0
         while not self.printer.is_shutdown():
             i += 1
             last_move_time = toolhead.get_last_move_time()
             is_triggered = bool(endstop.query_endstop(last_move_time))
-            self.log.trace("Check #%d of %s endstop: %s" % (i, endstop_name, ("Triggered" if is_triggered else "Not Triggered")))
+            self.log.trace("Check #%d of %s endstop: %s", i, endstop_name, ("Triggered" if is_triggered else "Not Triggered"))
             if is_triggered == should_be_triggered:
                 break
-            # If not running continuesly then check for atempts.
-            if atempts > 0 and atempts <= i:
-                break
-            eventtime = self.reactor.pause(eventtime + dwell)
+            # If not running continuesly then stop when the time for the atempts is up.
+            if atempts > 0:
+                if eventtime >= deadline:
+                    break
+                eventtime = self.reactor.pause(min(eventtime + dwell, deadline))
+            else:
+                eventtime = self.reactor.pause(eventtime + dwell)
+            dwell = min(dwell * 2, max_dwell)
         # if i > 1 or atempts == 1:
         # self.log.debug("Endstop %s is %s Triggered after #%d checks." % (endstop_name, ("" if is_triggered else "Not"), i))
 
@@ -682,9 +745,8 @@ def parse_restore_type(gcmd, arg_name, default = None):
     elif type == '2':
         return 'XYZ'
     # Validate this is XYZ
-    for c in type:
-        if c not in XYZ_TO_INDEX:
-            raise gcmd.error("Invalid RESTORE_POSITION_TYPE")
+    if not XYZ_TO_INDEX.keys() >= set(type):
+        raise gcmd.error("Invalid RESTORE_POSITION_TYPE")
     return type
 
 XYZ_TO_INDEX = {'x': 0, 'X':0, 'y':1, 'Y': 1, 'z': 2, 'Z':2}
@@ -1,92 +1,93 @@
 
+import os
 import sys
-import math
+from math import hypot
 import re
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, deque
+from itertools import accumulate, islice
 
-def calc_execution_time(lines):
-        try:              
-            nMatchLines = {}
-            currentFeedRate = 0
-            currentX = 0
-            currentY = 0
-            
-            for i, line in enumerate(lines):
-              ##print(line)
-              
-              nLineInfo = {}
-              deltaX = 0
-              deltaY = 0
-              newX = 0
-              newY = 0
-              
-              match = re.search(r'^G1(\s(X)(\d*\.*\d*))*(\s(Y)(\d*\.*\d*))*(\s(E)((-)*\d*\.*\d*))*(\s(F)(\d+\.*\d*))*', line)
-              if match:
-                  nLineInfo["pos"] = i
-                  for grp in match.groups():
-                      if grp is not None:
-                          if len(grp) > 1:
-                              m = re.search(r'(X|Y|E|F)(-*\d*\.*\d*)',grp)
-                              if m:
-                                  nLineInfo[m.group(1)] = m.group(2)    
-                                               
-                  if "F" in nLineInfo:
-                     currentFeedRate =  float(nLineInfo["F"])
-                    ##print("Feedrate Found:",currentFeedRate)
-                  
-                  if "X" in nLineInfo:
-                     deltaX = abs(float(nLineInfo["X"]) - currentX )
-                     currentX = float(nLineInfo["X"])                 
-                     ##print("DX:",deltaX)
-        
-                  if "Y" in nLineInfo:
-                     deltaY = abs(float(nLineInfo["Y"]) - currentY)
-                     currentY = float(nLineInfo["Y"])
-                     ##print("DY:",deltaY)
-                   
-                  if deltaX > 0 or deltaY > 0:
-                     mmPerSecond = currentFeedRate / 60 
-                     segmentLength = math.sqrt(deltaX**2 + deltaY**2)
-                     moveTime = float(segmentLength / mmPerSecond)
-                     ##print("Time Calculation:",moveTime )  
-                     nLineInfo["moveTime"] = moveTime
-              nMatchLines[i] = nLineInfo     
-                  
-            return nMatchLines;
-                
-        except Exception as e:
-            print(f"An error occurred: {str(e)}")
-                  
-    
-def get_index_by_duration(nTimeCalculation,start_index, duration,direction):
+# G1 move with optional X, Y, E and F values, in the order the slicer writes them.
+# Matches at the start of every line, so it can be run over the whole file.
+_G1_RE = re.compile(r'^G1(?:[ \t]+X(-?\d*\.?\d*))?(?:[ \t]+Y(-?\d*\.?\d*))?(?:[ \t]+E(-?\d*\.?\d*))?(?:[ \t]+F(\d+\.?\d*))?', re.MULTILINE)
+
+def calc_execution_time(text):
+    # Time each line takes to execute in seconds, 0 for anything but an XY move.
+    nMatchLines = array('d', [0.0]) * (text.count("\n") + 1)
+    currentFeedRate = 0
+    mmPerSecond = 0
+    currentX = 0
+    currentY = 0
     
-    try:
+    # Let the regex engine find all G1 lines in one go and count the newlines
+    # skipped since the previous one to know which line each match is on.
+    i = 0
+    lastPos = 0
+    for match in _G1_RE.finditer(text):
+        i += text.count("\n", lastPos, match.start())
+        lastPos = match.start()
+        deltaX = 0
+        deltaY = 0
+        x, y, e, f = match.groups()
+                                       
+        if f:
+            currentFeedRate =  float(f)
+            mmPerSecond = currentFeedRate / 60 
+            ##print("Feedrate Found:",currentFeedRate)
+          
+        if x:
+            newX = float(x)
+            deltaX = abs(newX - currentX )
+            currentX = newX                 
+            ##print("DX:",deltaX)
 
-        k=start_index
+        if y:
+            newY = float(y)
+            deltaY = abs(newY - currentY)
+            currentY = newY
+            ##print("DY:",deltaY)
+           
+        if deltaX > 0 or deltaY > 0:
+            segmentLength = hypot(deltaX, deltaY)
+            moveTime = segmentLength / mmPerSecond
+            ##print("Time Calculation:",moveTime )  
+            nMatchLines[i] = moveTime
+          
+    return nMatchLines;
+                  
+    
+# nTimeSums[i] is the time the lines before line i take, so lines a to b-1 take nTimeSums[b] - nTimeSums[a].
+# Returns the line reached after walking at least duration seconds from start_index in the given direction.
+def get_index_by_duration(nTimeSums,start_index, duration,direction):
+    lineCount = len(nTimeSums) - 1
+    if duration <= 0 or start_index <= 0 or start_index >= lineCount:
+        return start_index
 
-        totaltime = 0
-        currentpos = k
-        lineoffset = 0
-        while totaltime < duration  and k > 0 and k < len(nTimeCalculation):
-            if("moveTime" in nTimeCalculation[k]):
-                totaltime= totaltime + nTimeCalculation[k]['moveTime']
-                #currentpos = k
-                lineoffset = lineoffset + 1
-            if direction=="FORWARD":
-                k = k + 1
-            else:
-                k = k - 1
-            
-        currentpos = k
-        return currentpos
-        
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
+    if direction=="FORWARD":
+        # First line after start_index with at least duration seconds of moves from start_index up to it.
+        return min(bisect_left(nTimeSums, nTimeSums[start_index] + duration, start_index + 1), lineCount)
+    else:
+        # Last line from which the moves up to and including start_index take at least duration seconds.
+        k = bisect_right(nTimeSums, nTimeSums[start_index + 1] - duration, 0, start_index + 1) - 1
+        return k - 1 if k > 0 else 0
 
-def getNexToolUsageIndex(nTempMatches,tool):
-    for key in nTempMatches:
-        if int(nTempMatches[key][1]) == int(tool) :
-            return nTempMatches[key][0]
-    return -1
+# Yields the lines with each (index, text) insert placed before the original line at that index.
+# Lines and inserts have no newline, one is written after each of them except the last line.
+def merge_inserts(lines, inserts):
+    inserts.sort(key=lambda insert: insert[0])
+    lastIndex = len(lines) - 1
+    remaining = iter(lines)
+    pos = 0
+    for index, text in inserts:
+        index = min(index, lastIndex)
+        for line in islice(remaining, index - pos):
+            yield line + "\n"
+        yield text + "\n"
+        pos = index
+    for line in islice(remaining, lastIndex - pos):
+        yield line + "\n"
+    yield from remaining
 
 def process_toolchangerutils(file_path: str):
     try:
@@ -96,60 +97,71 @@ def process_toolchangerutils(file_path: str):
 
                     
                            
+        # Read the file once, the G1 scan runs on the whole text and the rest works on its lines.
+        # Split on newlines only so the line numbers match the newlines calc_execution_time counts.
         with open(file_path, 'r') as file:
-              lines = file.readlines()
+              text = file.read()
+        lines = text.split("\n")
     
-        nTimeCalculation = calc_execution_time(lines)
+        nTimeCalculation = calc_execution_time(text)
+        del text
+        nTimeSums = [0.0]
+        nTimeSums.extend(accumulate(nTimeCalculation))
          
-        nMatches = {}
-        nTempMatches={}
-        k=0
+        # Tool changes in the file as (line index, tool number).
+        toolSites = []
+        # Line indexes of the tool changes still ahead, by tool number.
+        nextToolUsage = defaultdict(deque)
         for i, line in enumerate(lines):
-          match = re.search(r'^(T(\d))$', line)
-          if match:
-              nMatches[k] = [i,match.group(2)]
-              nTempMatches[k] = [i,match.group(2)]
-              k=k+1     
+          # Tool change line, e.g. T1. Most lines don't start with a T so check that first.
+          if line[:1] == "T" and len(line) == 2 and line[1].isdecimal():
+              toolSites.append((i, int(line[1])))
+              nextToolUsage[int(line[1])].append(i)
         
-        k=0       
+        # Lines to add as (index, text), all indexes refer to the lines as read from the file.
+        inserts = []
         currentTool = -1
-        for key in nMatches:              
-            compareIndex = 0
-            if currentTool in nMatches:
-                compareIndex = nMatches[key-1][0] + k;
+        for key, (toolLine, tool) in enumerate(toolSites):              
+            # Predictive heating must go after the previous tool change.
+            compareIndex = toolSites[key-1][0] if key > 0 else 0
 
-            #print("Found T",nMatches[key][1],' at ',nMatches[key][0])
+            #print("Found T",tool,' at ',toolLine)
     
-            insert_index = get_index_by_duration(nTimeCalculation,nMatches[key][0] ,predictive_offset_duration,"BACKWARD")
+            insert_index = get_index_by_duration(nTimeSums,toolLine ,predictive_offset_duration,"BACKWARD")
             #print("Insert Index ",insert_index)
             if insert_index > compareIndex :
-               ##print("Insert Predictive heating for T",nMatches[key][1],' at ',insert_index)
-               lines.insert(insert_index, "M568 P"+nMatches[key][1]+" A2 ;Predictive Heating\n")
-               k=k+1
+               ##print("Insert Predictive heating for T",tool,' at ',insert_index)
+               inserts.append((insert_index, "M568 P"+str(tool)+" A2 ;Predictive Heating"))
                
             if currentTool >= 0:
-                nextToolUsageIndex = getNexToolUsageIndex(nTempMatches,currentTool)
-                lineOffsetByDuration = get_index_by_duration(nTimeCalculation,nMatches[key][0]+k ,nextuse_duration,"FORWARD")
+                nextToolUsageIndex = nextToolUsage[currentTool][0] if nextToolUsage[currentTool] else -1
+                lineOffsetByDuration = get_index_by_duration(nTimeSums,toolLine ,nextuse_duration,"FORWARD")
                 #print("Next Tool Usage - T",currentTool," -- ",nextToolUsageIndex)
                 #print("Next Tool Forward Time Index - T",currentTool," -- ",lineOffsetByDuration)
                 
                 if nextToolUsageIndex >=0 and lineOffsetByDuration > nextToolUsageIndex :
                     #print("Insert Continue heating for T",str(currentTool),' at ',lineOffsetByDuration)
-                    insert_index_continue = nMatches[key][0] + 1 + k
-                    lines.insert(insert_index_continue, "M568 P"+ str(currentTool) + " A2 ;Continue Heating\n")    
-                    k=k+1
+                    insert_index_continue = toolLine + 1
+                    inserts.append((insert_index_continue, "M568 P"+ str(currentTool) + " A2 ;Continue Heating"))
                 #else:
-                    #print("DONT INSERT Continue heating for T",nMatches[key][1],' - Next Tool Usage at ',nextToolUsageIndex, ' is before Time Index at', lineOffsetByDuration)                    
+                    #print("DONT INSERT Continue heating for T",tool,' - Next Tool Usage at ',nextToolUsageIndex, ' is before Time Index at', lineOffsetByDuration)                    
             
                 
                 
-            currentTool = int(nMatches[key][1])         
-            nTempMatches.pop(key)
+            currentTool = tool         
+            nextToolUsage[currentTool].popleft()
                
    
-        with open(file_path, 'w') as file:
-           for i, line in enumerate(lines):
-               file.write(line)
+        # Write next to the original and swap it in, so the slicer output is never left half written.
+        tmp_path = file_path + '.ktcc.tmp'
+        try:
+            with open(tmp_path, 'w') as file:
+               file.writelines(merge_inserts(lines, inserts))
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
         
     except FileNotFoundError:
         print(f"File '{file_path}' not found.")